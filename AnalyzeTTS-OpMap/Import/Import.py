@@ -1,12 +1,28 @@
-import json
+import argparse
+import functools
 import os
+import sys
 import uuid
 
-with open('templates.json') as templateFile:
-    templateStr = templateFile.read()
+ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+from sotn import jsonio
+from sotn.memo import BuildCache
+
+# set by main(): the templates text and the subtree cache keyed by it
+templateStr = None
+cache = None
+
+def memoized(fn):
+    """cache.memoize, resolved per call since the cache only exists once main() runs."""
+    @functools.wraps(fn)
+    def wrapper(*args):
+        return cache.memoize(fn)(*args)
+    return wrapper
 
 def getTemplate(name):
-    templates = json.loads(templateStr)
+    templates = jsonio.loads(templateStr)
     template = templates[name]
     template['GUID'] = str(uuid.uuid4())[:6]
     return template
@@ -14,7 +30,8 @@ def getTemplate(name):
 def createCardEntry(data):
     card = getTemplate('cardEntry')
     card['FaceURL'] = data['front_png_url']
-    card['BackURL'] = data['back_png_url']
+    # cards without a back of their own (e.g. from --vmod) keep the template's shared back
+    card['BackURL'] = data['back_png_url'] or card['BackURL']
     return dict(card)
 
 def createCard(cardID, cardEntry):
@@ -23,6 +40,7 @@ def createCard(cardID, cardEntry):
     card['CustomDeck'] = {cardID:cardEntry}
     return card
     
+@memoized
 def createDeck(data, name):
     deck = getTemplate('deck')
     deck['CustomDeck'] = {str(i+1):createCardEntry(data[cardEntry]) for i,cardEntry in enumerate(data)}
@@ -30,6 +48,27 @@ def createDeck(data, name):
     deck['Nickname'] = name
     deck['ContainedObjects'] = [createCard(cardId, entry) for cardId, entry in deck['CustomDeck'].items()]
     return deck
+
+def createAtlasDeck(data, name, directory):
+    from sotn.atlas import packDeck
+
+    cards = [data[cardEntry] for cardEntry in data]
+    sheets = packDeck(directory, name.replace(' ', '_'), [(c['front_png_url'], c['back_png_url']) for c in cards],
+                      back=getTemplate('cardEntry')['BackURL'])
+    deck = getTemplate('deck')
+    deck['GUID'] = cache.stableGuid(name, deck['GUID'])
+    deck['Nickname'] = name
+    for sheetId, sheet in enumerate(sheets, 1):
+        entry = getTemplate('cardEntry')
+        entry.update({k: sheet[k] for k in ('FaceURL', 'BackURL', 'NumWidth', 'NumHeight')})
+        deck['CustomDeck'][str(sheetId)] = entry
+        for index in range(sheet['count']):
+            card = createCard(str(sheetId), entry)
+            card['CardID'] = sheetId * 100 + index
+            card['GUID'] = cache.stableGuid(f"{name}/{card['CardID']}", card['GUID'])
+            deck['DeckIDs'].append(card['CardID'])
+            deck['ContainedObjects'].append(card)
+    return deck
     
 def createTile(data, name, tags):
     frontUrl = data.get('front_png_url')
@@ -56,6 +95,7 @@ def createCounterBox(data, name, tags):
         bag['ContainedObjects'].append(groupObject)
     return bag
 
+@memoized
 def createObject(data, name, tags):
     tile = createTile(data, name, tags)
     if tile is not None:
@@ -64,27 +104,78 @@ def createObject(data, name, tags):
         return createCounterBox(data, name, tags)
     
 
-with open('Red_Strike_V1_2.vmod_factions.json') as dataFile:
-    factionData =json.loads(dataFile.read())
-    
-with open('Red_Strike_V1_2.vmod_cards.json') as dataFile:
-    cardData =json.loads(dataFile.read())
+def readModule(path, imageDir):
+    """factionData, cardData and markersData as the extracted json files hold them, from the .vmod itself."""
+    from sotn.vassal import VassalModule, find, isPiece, pieces
 
-with open('Red_Strike_V1_2.vmod_markers.json') as dataFile:
-    markersData =json.loads(dataFile.read())
-    
-counterBag = getTemplate('bag')
-counterBag['Nickname'] = 'Generated Counters'
-counterBag['ContainedObjects'] = [
-    createCounterBox(factionData['NATO Units'],'NATO',['NATO']), 
-    createCounterBox(factionData['WP Units'],'Pact',['WP']),
-    createCounterBox(markersData,'Markers',['Marker']),
-    createDeck(cardData['NATO Cards'],'NATO Cards'),
-    createDeck(cardData['WP Cards'],'Pact Cards')
-    ]
-
-ttsSave = getTemplate('ttsSave')
-ttsSave['ObjectStates'] = [counterBag]
-with open('RS89_Tokens.json','w') as counterFile:
-    json.dump(ttsSave,counterFile, indent=4)
-    
\ No newline at end of file
+    with VassalModule(path) as module:
+        palette = module.palette()
+        sections = {name: find(palette, name) or {}
+                    for name in ('NATO Units', 'WP Units', 'Markers', 'NATO Cards', 'WP Cards')}
+        used = {image for section in sections.values() for _, piece in pieces(section)
+                for image in (piece['front_png'], piece['back_png']) if image}
+        images = module.extractImages(sorted(used), imageDir)
+    missing = sorted(used - set(images))
+    if missing:
+        print('%d images not in %s (pieces without their front are left out): %s' % (len(missing), path, ', '.join(missing[:5])))
+
+    def withUrls(node):
+        entries = {}
+        for name, child in node.items():
+            if not isPiece(child):
+                entries[name] = withUrls(child)
+            elif child['front_png'] in images:
+                back = images.get(child['back_png'])
+                entries[name] = {'front_png_url': os.path.abspath(images[child['front_png']]),
+                                 'back_png_url': os.path.abspath(back) if back else ''}
+        return entries
+
+    factions = {'NATO Units': withUrls(sections['NATO Units']), 'WP Units': withUrls(sections['WP Units'])}
+    cards = {name: withUrls(dict(pieces(sections[name]))) for name in ('NATO Cards', 'WP Cards')}
+    return factions, cards, withUrls(sections['Markers'])
+
+def main(argv=None):
+    global templateStr, cache
+    parser = argparse.ArgumentParser(description='Generate RS89_Tokens.json from the Vassal module data')
+    parser.add_argument('--atlas', metavar='DIR', help='pack card faces into 10x7 deck sheets in DIR (local images only)')
+    parser.add_argument('--vmod', help='read factions, cards and markers straight from this VASSAL module instead of the extracted json files')
+    parser.add_argument('--images', default='images', help='with --vmod, extract the images the counters use to this directory')
+    args = parser.parse_args(argv)
+
+    with open('templates.json') as templateFile:
+        templateStr = templateFile.read()
+
+    # Unchanged subtrees (and their GUIDs) are reused from the previous run;
+    # delete the cache file to regenerate everything.
+    cache = BuildCache('Import.cache.json', salt=templateStr)
+
+    if args.vmod:
+        factionData, cardData, markersData = readModule(args.vmod, args.images)
+    else:
+        factionData = jsonio.load('Red_Strike_V1_2.vmod_factions.json')
+        cardData = jsonio.load('Red_Strike_V1_2.vmod_cards.json')
+        markersData = jsonio.load('Red_Strike_V1_2.vmod_markers.json')
+
+    counterBag = getTemplate('bag')
+    counterBag['GUID'] = cache.stableGuid('Generated Counters', counterBag['GUID'])
+    counterBag['Nickname'] = 'Generated Counters'
+    counterBag['ContainedObjects'] = [
+        createObject(factionData['NATO Units'],'NATO',['NATO']), 
+        createObject(factionData['WP Units'],'Pact',['WP']),
+        createObject(markersData,'Markers',['Marker']),
+        ]
+    for deckName, deckData in (('NATO Cards', cardData['NATO Cards']), ('Pact Cards', cardData['WP Cards'])):
+        if args.atlas:
+            counterBag['ContainedObjects'].append(createAtlasDeck(deckData, deckName, args.atlas))
+        else:
+            counterBag['ContainedObjects'].append(createDeck(deckData, deckName))
+
+    ttsSave = getTemplate('ttsSave')
+    ttsSave['GUID'] = cache.stableGuid('ttsSave', ttsSave['GUID'])
+    ttsSave['ObjectStates'] = [counterBag]
+    jsonio.dump(ttsSave, 'RS89_Tokens.json', indent=4)
+    cache.save()
+    print('Reused %d subtrees, regenerated %d' % (cache.hits, cache.misses))
+
+if __name__ == '__main__':
+    main()
@@ -1,69 +1,31 @@
-import json
+import os
+import sys
 import numpy as np
-from lupa.lua54 import LuaRuntime
-lua = LuaRuntime(unpack_returned_tuples=True)
 
-lua.globals().loadfile('towns.lua')()
+ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+from sotn import jsonio
+from sotn.layers import geoReferencedMap
+from sotn.bounds import boundsFromPawns
+from sotn.saveindex import SaveIndex
+from sotn.validation import validationReport, writeReport
 
-towns = lua.globals()['towns']
+# the towns.lua table and the map transform of the calibration save, set by calibrate()
+towns = None
+mapT = None
 
-def find_map_transform(objects, preferred_names=None):
+def find_map_transform(index, preferred_names=None):
     # try preferred nicknames first (strict: raise if none found)
     preferred_names = preferred_names or ['StratMap']
-    for name in preferred_names:
-        for obj in objects:
-            if obj.get('Nickname') == name and obj.get('Transform'):
-                return obj['Transform']
+    mapObject = index.first(preferred_names)
+    if mapObject:
+        return mapObject['Transform']
 
     # not found -> raise a clear error listing available objects
-    available = [{'Nickname': o.get('Nickname'), 'Name': o.get('Name')} for o in objects]
+    available = [{'Nickname': o.get('Nickname'), 'Name': o.get('Name')} for o in index.objects]
     raise RuntimeError(f"Could not locate map with preferred nicknames {preferred_names}. Available objects: {available}")
 
-# Load TTS.json and collect map + city markers
-cityCounters = []
-with open('TTS.json') as ttsFile:
-    ttsJson = json.load(ttsFile)
-    objects = ttsJson.get('ObjectStates', [])
-    print(f"Loaded TTS.json: {len(objects)} top-level objects")
-    mapT = find_map_transform(objects, preferred_names=['StratMap'])
-    print("Map transform found:" if mapT else "Map transform NOT found")
-    # debug: show candidate objects with Nickname/Tags
-    for i,obj in enumerate(objects[:200]):
-        nick = obj.get('Nickname')
-        tags = obj.get('Tags')
-        if nick or tags:
-            print(f"obj[{i}] Nickname={nick!r} Tags={tags!r}")
-    if not mapT:
-        print("Warning: map transform not found in TTS.json. Aborting.")
-    for obj in objects:
-        # Use Nickname (not Tags) to find city markers
-        nick = obj.get('Nickname')
-        if not nick or not isinstance(nick, str) or nick.strip() == '':
-            # no nickname -> skip
-            continue
-        name = nick.replace('\n', '').strip()
-        matched = False
-        # try exact match against towns.lua (Lua table)
-        try:
-            if towns[name] is not None:
-                cityCounters.append((name, obj['Transform']))
-                matched = True
-        except Exception:
-            pass
-        if not matched:
-            # try underscores -> spaces
-            alt = name.replace('_', ' ')
-            try:
-                if towns[alt] is not None:
-                    cityCounters.append((alt, obj['Transform']))
-                    matched = True
-            except Exception:
-                pass
-        if matched:
-            print(f"Matched nickname -> town: '{name}'")
-        else:
-            print(f"Skipped nickname (no town): '{name}'")
-
 def relativeOffset(objectTransform, mapTransform):
     x = (objectTransform['posX']-mapTransform['posX'])/mapTransform['scaleX']
     z = (objectTransform['posZ']-mapTransform['posZ'])/mapTransform['scaleZ']
@@ -135,7 +97,7 @@ def solve_ransac(counters, index, component, n_iter=100, threshold=0.01):
         if len(inliers) > len(best_inliers):
             best_inliers = inliers
             best_coeffs = tuple(float(R.item(i)) for i in range(6))
-    # Refit using all inliers
+    # Refit using all inliers; returns the coefficients and the inlier mask
     if best_inliers and len(best_inliers) >= 6:
         final_counters = [counters[i] for i in best_inliers]
         m = constructMatrix(final_counters, index)
@@ -144,7 +106,7 @@ def solve_ransac(counters, index, component, n_iter=100, threshold=0.01):
         M = np.matmul(mT, m)
         V = np.matmul(mT, v)
         R = np.linalg.solve(M, V)
-        return tuple(float(R.item(i)) for i in range(6))
+        return tuple(float(R.item(i)) for i in range(6)), np.isin(np.arange(len(counters)), best_inliers)
     # fallback to least squares if RANSAC fails
     m = constructMatrix(counters, index)
     v = getGeoLocations(counters, component)
@@ -152,40 +114,91 @@ def solve_ransac(counters, index, component, n_iter=100, threshold=0.01):
     M = np.matmul(mT, m)
     V = np.matmul(mT, v)
     R = np.linalg.solve(M, V)
-    return tuple(float(R.item(i)) for i in range(6))
+    return tuple(float(R.item(i)) for i in range(6)), np.ones(len(counters), bool)
 
 def solve(counters, index, component):
     # Use RANSAC robust fitting
     return solve_ransac(counters, index, component, n_iter=200, threshold=0.01)
 
-# Validate we found map and enough city markers
-if not mapT:
-    raise SystemExit("Map transform not found in TTS.json; make sure the map object's Nickname matches expected names.")
-
-print(f"Collected {len(cityCounters)} candidate city markers: {[c[0] for c in cityCounters]}")
-if len(cityCounters) < 6:
-    raise SystemExit("Insufficient city markers to compute 2D quadratic mapping. Need at least 6.")
-
-easting = solve(cityCounters, 0, 'longitude')  # (a, b, c, d, e, f)
-northing = solve(cityCounters, 1, 'latitude')  # (a, b, c, d, e, f)
-
-def getBounds():
-    with open('Bounds.json') as boundsFile:
-        boundsJson = json.load(boundsFile)
-        objects = boundsJson.get('ObjectStates', [])
-        mapTransform = find_map_transform(objects, preferred_names=['StratMap'])
-        corners = {}
-        if not mapTransform:
-            print("Warning: map transform not found in Bounds.json")
-        for object in objects:
-            if object.get('Name') == 'Chess_Pawn' and object.get('Nickname'):
-                if mapTransform:
-                    corners[object['Nickname']] = relativeOffset(object['Transform'], mapTransform)
-        return corners
-
-bounds = getBounds()
-
-with open('tts2lola.json','w') as out:
+def getBounds(path='Bounds.json'):
+    boundsIndex = SaveIndex(jsonio.load(path))
+    mapTransform = find_map_transform(boundsIndex, preferred_names=['StratMap'])
+    corners = {}
+    if not mapTransform:
+        print("Warning: map transform not found in Bounds.json")
+    for object in boundsIndex.withName('Chess_Pawn', topLevel=True):
+        if object.get('Nickname'):
+            if mapTransform:
+                corners[object['Nickname']] = relativeOffset(object['Transform'], mapTransform)
+    return corners
+
+def calibrate(savePath='TTS.json', boundsPath='Bounds.json', townsPath='towns.lua', outPath='tts2lola.json'):
+    """Fit the StratMap transform from the calibration saves and towns.lua, write tts2lola.json and its validation report."""
+    global towns, mapT
+    from lupa.lua54 import LuaRuntime
+
+    lua = LuaRuntime(unpack_returned_tuples=True)
+
+    lua.globals().loadfile(townsPath)()
+
+    towns = lua.globals()['towns']
+
+    # Load TTS.json and collect map + city markers
+    cityCounters = []
+    ttsJson = jsonio.load(savePath)
+    index = SaveIndex(ttsJson)
+    objects = index.objects
+    print(f"Loaded TTS.json: {len(objects)} top-level objects")
+    mapT = find_map_transform(index, preferred_names=['StratMap'])
+    print("Map transform found:" if mapT else "Map transform NOT found")
+    # debug: show candidate objects with Nickname/Tags
+    for i,obj in enumerate(objects[:200]):
+        nick = obj.get('Nickname')
+        tags = obj.get('Tags')
+        if nick or tags:
+            print(f"obj[{i}] Nickname={nick!r} Tags={tags!r}")
+    if not mapT:
+        print("Warning: map transform not found in TTS.json. Aborting.")
+    for name in index.byNickname:
+        # Use Nickname (not Tags) to find city markers; one lookup per distinct nickname
+        markers = index.withNickname(name, topLevel=True)
+        if not markers:
+            continue
+        matched = False
+        # try exact match against towns.lua (Lua table)
+        try:
+            if towns[name] is not None:
+                cityCounters.extend((name, obj['Transform']) for obj in markers)
+                matched = True
+        except Exception:
+            pass
+        if not matched:
+            # try underscores -> spaces
+            alt = name.replace('_', ' ')
+            try:
+                if towns[alt] is not None:
+                    cityCounters.extend((alt, obj['Transform']) for obj in markers)
+                    matched = True
+            except Exception:
+                pass
+        if matched:
+            print(f"Matched nickname -> town: '{name}'")
+        else:
+            print(f"Skipped nickname (no town): '{name}'")
+
+    # Validate we found map and enough city markers
+    if not mapT:
+        raise SystemExit("Map transform not found in TTS.json; make sure the map object's Nickname matches expected names.")
+
+    print(f"Collected {len(cityCounters)} candidate city markers: {[c[0] for c in cityCounters]}")
+    if len(cityCounters) < 6:
+        raise SystemExit("Insufficient city markers to compute 2D quadratic mapping. Need at least 6.")
+
+    easting, lonInliers = solve(cityCounters, 0, 'longitude')  # (a, b, c, d, e, f)
+    northing, latInliers = solve(cityCounters, 1, 'latitude')  # (a, b, c, d, e, f)
+
+    bounds = getBounds(boundsPath)
+
     data = {
         'easting': {
             'a': easting[0], 'b': easting[1], 'c': easting[2],
@@ -195,21 +208,17 @@ with open('tts2lola.json','w') as out:
             'a': northing[0], 'b': northing[1], 'c': northing[2],
             'd': northing[3], 'e': northing[4], 'f': northing[5]
         },
-        'bounds': {
-            'NorthEast': [bounds['NorthEast'][1], bounds['NorthEast'][0]],
-            'SouthWest': [bounds['SouthWest'][1], bounds['SouthWest'][0]]
-        }
+        # relativeOffset here gives (x, z); tts2lola.json keeps (z, x)
+        'bounds': boundsFromPawns({name: (z, x) for name, (x, z) in bounds.items()})
     }
-    json.dump(data, out, indent=4)
-    
+    jsonio.dump(data, outPath, indent=4)
+
+    # report what the converter computes from the file just written
+    crs = geoReferencedMap('StratMap', outPath)
+    predicted = []
     for cityCounter in cityCounters:
         pos = relativeOffset(cityCounter[1], mapT)
-        # Use 2D quadratic transformation for error reporting
-        x, y = pos[1], pos[0]
-        geo = (
-            easting[0]*x**2 + easting[1]*y**2 + easting[2]*x*y + easting[3]*x + easting[4]*y + easting[5],
-            northing[0]*x**2 + northing[1]*y**2 + northing[2]*x*y + northing[3]*x + northing[4]*y + northing[5]
-        )
+        geo = crs.relativeToLoLa(pos[1], pos[0])
         try:
             town = towns[cityCounter[0]]
             lon = town['longitude']; lat = town['latitude']
@@ -219,4 +228,15 @@ with open('tts2lola.json','w') as out:
         if lon is not None and lat is not None:
             err = (geo[0] - lon, geo[1] - lat)
         print(f'{cityCounter[0]}: {geo}, ({err})')
-
+        predicted.append(geo)
+
+    # leave-one-out validation of the fit, written next to tts2lola.json
+    lonLat = np.hstack([getGeoLocations(cityCounters, 'longitude'), getGeoLocations(cityCounters, 'latitude')])
+    designs = (constructMatrix(cityCounters, 0), constructMatrix(cityCounters, 1))
+    writeReport(validationReport('StratMap', [c[0] for c in cityCounters], designs, lonLat, predicted,
+                                 inliers=(lonInliers, latInliers)),
+                outPath.replace('tts2lola.json', 'tts2lola_validation.json'))
+    return data
+
+if __name__ == '__main__':
+    calibrate()
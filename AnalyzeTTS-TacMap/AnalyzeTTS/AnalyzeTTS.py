@@ -1,21 +1,28 @@
-import json
+import os
+import sys
 import numpy as np
-from lupa.lua54 import LuaRuntime
-lua = LuaRuntime(unpack_returned_tuples=True)
 
-lua.globals().loadfile('towns.lua')()
+ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+from sotn import jsonio
+from sotn.layers import geoReferencedMap
+from sotn.bounds import boundsFromPawns
+from sotn.saveindex import SaveIndex
+from sotn.validation import validationReport, writeReport
 
-towns = lua.globals()['towns']
+# the towns.lua table and the map transform of the calibration save, set by calibrate()
+towns = None
+mapT = None
 
-def find_map_transform(objects, preferred_names=None):
+def find_map_transform(index, preferred_names=None):
     # try preferred nicknames first
     preferred_names = preferred_names or ['TacMap', 'Tactical Map - Test', 'Tactical Map', 'TacticalMap']
-    for name in preferred_names:
-        for obj in objects:
-            if obj.get('Nickname') == name and obj.get('Transform'):
-                return obj['Transform']
+    mapObject = index.first(preferred_names)
+    if mapObject:
+        return mapObject['Transform']
     # fallback: pick object with a Transform and the largest scale (likely the map)
-    candidates = [o for o in objects if o.get('Transform') and isinstance(o['Transform'], dict)]
+    candidates = [o for o in index.objects if o.get('Transform') and isinstance(o['Transform'], dict)]
     if not candidates:
         return None
     # choose by scaleX * scaleZ (map is usually much larger than tokens)
@@ -25,51 +32,6 @@ def find_map_transform(objects, preferred_names=None):
     candidates.sort(key=size_score, reverse=True)
     return candidates[0]['Transform']
 
-# Load TTS.json and collect map + city markers
-cityCounters = []
-with open('TTS.json') as ttsFile:
-    ttsJson = json.load(ttsFile)
-    objects = ttsJson.get('ObjectStates', [])
-    print(f"Loaded TTS.json: {len(objects)} top-level objects")
-    mapT = find_map_transform(objects, preferred_names=['TacMap', 'Tactical Map - Test', 'Tactical Map'])
-    print("Map transform found:" if mapT else "Map transform NOT found")
-    # debug: show candidate objects with Nickname/Tags
-    for i,obj in enumerate(objects[:200]):
-        nick = obj.get('Nickname')
-        tags = obj.get('Tags')
-        if nick or tags:
-            print(f"obj[{i}] Nickname={nick!r} Tags={tags!r}")
-    if not mapT:
-        print("Warning: map transform not found in TTS.json. Aborting.")
-    for obj in objects:
-        # Use Nickname (not Tags) to find city markers
-        nick = obj.get('Nickname')
-        if not nick or not isinstance(nick, str) or nick.strip() == '':
-            # no nickname -> skip
-            continue
-        name = nick.replace('\n', '').strip()
-        matched = False
-        # try exact match against towns.lua (Lua table)
-        try:
-            if towns[name] is not None:
-                cityCounters.append((name, obj['Transform']))
-                matched = True
-        except Exception:
-            pass
-        if not matched:
-            # try underscores -> spaces
-            alt = name.replace('_', ' ')
-            try:
-                if towns[alt] is not None:
-                    cityCounters.append((alt, obj['Transform']))
-                    matched = True
-            except Exception:
-                pass
-        if matched:
-            print(f"Matched nickname -> town: '{name}'")
-        else:
-            print(f"Skipped nickname (no town): '{name}'")
-
 def relativeOffset(objectTransform, mapTransform):
     x = (objectTransform['posX']-mapTransform['posX'])/mapTransform['scaleX']
     z = (objectTransform['posZ']-mapTransform['posZ'])/mapTransform['scaleZ']
@@ -109,51 +71,115 @@ def solve(counters, index, component):
     R = np.linalg.solve(M,V)
     return (float(R.item(0)), float(R.item(1)))
 
-# Validate we found map and enough city markers
-if not mapT:
-    raise SystemExit("Map transform not found in TTS.json; make sure the map object's Nickname matches expected names.")
-
-print(f"Collected {len(cityCounters)} candidate city markers: {[c[0] for c in cityCounters]}")
-if len(cityCounters) < 2:
-    raise SystemExit("Insufficient city markers to compute mapping. Check Tags in TTS.json and towns.lua keys.")
-
-easting = solve(cityCounters,0,'longitude')
-northing = solve(cityCounters,1,'latitude')
-
-def getBounds():
-    with open('Bounds.json') as boundsFile:
-        boundsJson = json.load(boundsFile)
-        objects = boundsJson.get('ObjectStates', [])
-        mapTransform = find_map_transform(objects, preferred_names=['TacMap', 'Tactical Map - Test', 'Tactical Map'])
-        corners = {}
-        if not mapTransform:
-            print("Warning: map transform not found in Bounds.json")
-        for object in objects:
-            if object.get('Name') == 'Chess_Pawn' and object.get('Nickname'):
-                if mapTransform:
-                    corners[object['Nickname']] = relativeOffset(object['Transform'], mapTransform)
-        return corners
-
-bounds = getBounds()
-
-with open('tts2lola.json','w') as out:
+def getBounds(path='Bounds.json'):
+    boundsIndex = SaveIndex(jsonio.load(path))
+    mapTransform = find_map_transform(boundsIndex, preferred_names=['TacMap', 'Tactical Map - Test', 'Tactical Map'])
+    corners = {}
+    if not mapTransform:
+        print("Warning: map transform not found in Bounds.json")
+    for object in boundsIndex.withName('Chess_Pawn', topLevel=True):
+        if object.get('Nickname'):
+            if mapTransform:
+                corners[object['Nickname']] = relativeOffset(object['Transform'], mapTransform)
+    return corners
+
+def calibrate(savePath='TTS.json', boundsPath='Bounds.json', townsPath='towns.lua', outPath='tts2lola.json'):
+    """Fit the TacMap transform from the calibration saves and towns.lua, write tts2lola.json and its validation report."""
+    global towns, mapT
+    from lupa.lua54 import LuaRuntime
+
+    lua = LuaRuntime(unpack_returned_tuples=True)
+
+    lua.globals().loadfile(townsPath)()
+
+    towns = lua.globals()['towns']
+
+    # Load TTS.json and collect map + city markers
+    cityCounters = []
+    ttsJson = jsonio.load(savePath)
+    index = SaveIndex(ttsJson)
+    objects = index.objects
+    print(f"Loaded TTS.json: {len(objects)} top-level objects")
+    mapT = find_map_transform(index, preferred_names=['TacMap', 'Tactical Map - Test', 'Tactical Map'])
+    print("Map transform found:" if mapT else "Map transform NOT found")
+    # debug: show candidate objects with Nickname/Tags
+    for i,obj in enumerate(objects[:200]):
+        nick = obj.get('Nickname')
+        tags = obj.get('Tags')
+        if nick or tags:
+            print(f"obj[{i}] Nickname={nick!r} Tags={tags!r}")
+    if not mapT:
+        print("Warning: map transform not found in TTS.json. Aborting.")
+    for name in index.byNickname:
+        # Use Nickname (not Tags) to find city markers; one lookup per distinct nickname
+        markers = index.withNickname(name, topLevel=True)
+        if not markers:
+            continue
+        matched = False
+        # try exact match against towns.lua (Lua table)
+        try:
+            if towns[name] is not None:
+                cityCounters.extend((name, obj['Transform']) for obj in markers)
+                matched = True
+        except Exception:
+            pass
+        if not matched:
+            # try underscores -> spaces
+            alt = name.replace('_', ' ')
+            try:
+                if towns[alt] is not None:
+                    cityCounters.extend((alt, obj['Transform']) for obj in markers)
+                    matched = True
+            except Exception:
+                pass
+        if matched:
+            print(f"Matched nickname -> town: '{name}'")
+        else:
+            print(f"Skipped nickname (no town): '{name}'")
+
+    # Validate we found map and enough city markers
+    if not mapT:
+        raise SystemExit("Map transform not found in TTS.json; make sure the map object's Nickname matches expected names.")
+
+    print(f"Collected {len(cityCounters)} candidate city markers: {[c[0] for c in cityCounters]}")
+    if len(cityCounters) < 2:
+        raise SystemExit("Insufficient city markers to compute mapping. Check Tags in TTS.json and towns.lua keys.")
+
+    easting = solve(cityCounters,0,'longitude')
+    northing = solve(cityCounters,1,'latitude')
+
+    bounds = getBounds(boundsPath)
+
     data ={
         'easting':{'scale': easting[0], 'offset':easting[1]},
         'northing':{'scale': northing[0], 'offset':northing[1]},
-        'bounds':bounds
+        'bounds':boundsFromPawns(bounds)
         }
-    json.dump(data, out, indent=4)
-    
-for cityCounter in cityCounters:
-    pos = relativeOffset(cityCounter[1], mapT)
-    geo = (pos[1]*easting[0]+easting[1], pos[0]*northing[0]+northing[1])
-    try:
-        town = towns[cityCounter[0]]
-        lon = town['longitude']; lat = town['latitude']
-    except Exception:
-        lon = lat = None
-    err = (None, None)
-    if lon is not None and lat is not None:
-        err = (geo[0] - lon, geo[1] - lat)
-    print(f'{cityCounter[0]}: {geo}, ({err})')
+    jsonio.dump(data, outPath, indent=4)
+
+    # report what the converter computes from the file just written
+    crs = geoReferencedMap('TacMap', outPath)
+    predicted = []
+    for cityCounter in cityCounters:
+        pos = relativeOffset(cityCounter[1], mapT)
+        geo = crs.relativeToLoLa(*pos)
+        try:
+            town = towns[cityCounter[0]]
+            lon = town['longitude']; lat = town['latitude']
+        except Exception:
+            lon = lat = None
+        err = (None, None)
+        if lon is not None and lat is not None:
+            err = (geo[0] - lon, geo[1] - lat)
+        print(f'{cityCounter[0]}: {geo}, ({err})')
+        predicted.append(geo)
+
+    # leave-one-out validation of the fit, written next to tts2lola.json
+    lonLat = np.hstack([getGeoLocations(cityCounters, 'longitude'), getGeoLocations(cityCounters, 'latitude')])
+    designs = (constructMatrix(cityCounters, 0), constructMatrix(cityCounters, 1))
+    writeReport(validationReport('TacMap', [c[0] for c in cityCounters], designs, lonLat, predicted),
+                outPath.replace('tts2lola.json', 'tts2lola_validation.json'))
+    return data
 
+if __name__ == '__main__':
+    calibrate()
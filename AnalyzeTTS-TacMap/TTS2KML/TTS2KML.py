@@ -1,18 +1,33 @@
-import json
-from pykml.factory import KML_ElementMaker as KML
-from lxml import etree
+import argparse
+import os
+import sys
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+# numpy, lxml and pykml are imported where they are used, so --help starts fast
+from sotn import jsonio
+from sotn.classify import EXCLUDE, classifierFor
+from sotn.records import UnitRecord
+from sotn.saveindex import SaveIndex
+
+LAYER = 'TacMap'
+TRANSFORM_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tts2lola.json')
+TOWNS_FILE = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'AnalyzeTTS', 'towns.lua'))
 
 class GeoReferencedMap:
-    def __init__(self, mapFile):
-        with open('tts2lola.json') as transformFile:
-            self.data = json.load(transformFile)
+    def __init__(self, mapFile=None, transformPath=TRANSFORM_FILE):
+        self.data = jsonio.load(transformPath)
+        self.mapTransform = None
             
-        with open(mapFile) as ttsFile:
-            ttsState=json.load(ttsFile)
-            for ttsObjects in ttsState['ObjectStates']:
-                if ttsObjects['Nickname'] == 'TacMap':
-                    self.mapTransform = ttsObjects['Transform']
-                    break
+        if mapFile is not None:
+            self.findMapTransform(jsonio.load(mapFile))
+
+    def findMapTransform(self, ttsState):
+        """Locate the TacMap object in a parsed save (or its SaveIndex) and use its transform."""
+        mapObject = SaveIndex.of(ttsState).first([LAYER])
+        self.mapTransform = mapObject['Transform'] if mapObject else None
+        return self.mapTransform
         
     def relativeOffset(self, objectTransform):
         x = (objectTransform['posX']-self.mapTransform['posX'])/self.mapTransform['scaleX']
@@ -21,9 +36,21 @@ class GeoReferencedMap:
         return (z, x)
     
     def toLoLa(self, transform):
-        x,y = self.relativeOffset(transform)
-        if( x < self.data['bounds']['SouthWest'][0] or y < self.data['bounds']['SouthWest'][1] or x > self.data['bounds']['NorthEast'][0] or y > self.data['bounds']['NorthEast'][1]):
-            return None
+        return self.toLoLaMany([transform])[0]
+
+    def toLoLaMany(self, transforms):
+        """toLoLa of many transforms with one bounds test (box, then polygon); None outside."""
+        from sotn.bounds import insideBounds, relativeOffsets
+
+        x, y = relativeOffsets(self.mapTransform,
+                               [t.get('posX', float('nan')) for t in transforms],
+                               [t.get('posZ', float('nan')) for t in transforms])
+        inside = insideBounds(self.data['bounds'], x, y)
+        lon, lat = self.relativeToLoLa(x[inside], y[inside])
+        positions = zip(lon.tolist(), lat.tolist())
+        return [next(positions) if keep else None for keep in inside.tolist()]
+
+    def relativeToLoLa(self, x, y):
         easting = self.data['easting']
         northing = self.data['northing']
         return (x*easting['scale']+easting['offset'], y*northing['scale']+northing['offset'])
@@ -31,30 +58,55 @@ class GeoReferencedMap:
 def toKmlCoord(point):
     return f"{point[0]},{point[1]}"
 def toKmlPoint(waypoint):
+    from pykml.factory import KML_ElementMaker as KML
+
     return KML.Point(KML.coordinates(toKmlCoord(waypoint)))
 
-def exportKml(doc, group):
+def exportKml(doc, group, styleUrl=None):
+    from pykml.factory import KML_ElementMaker as KML
+
     routeName = group.name
     linePoints = []
     wayPoints = []
 
-    for wp in group.points[1:]:
-        wayPoints.append(KML.Placemark(KML.name(wp.name),KML.styleUrl(f'#{stylename}'), toKmlPoint(wp)))
+    for wp in group.points:
+        # plain (lon, lat) points, e.g. of drawn lines, only shape the route
+        if hasattr(wp, 'name'):
+            style_name = wp.name.replace(' ', '')
+            wayPoints.append(KML.Placemark(KML.name(wp.name), KML.styleUrl(f'#{style_name}'), toKmlPoint(wp)))
         linePoints.append(toKmlCoord(wp))
 
-    routeLine = KML.Placemark(KML.name(routeName), KML.LineString(KML.coordinates("\n".join(linePoints))))
+    style = [KML.styleUrl(styleUrl)] if styleUrl else []
+    routeLine = KML.Placemark(KML.name(routeName), *style, KML.LineString(KML.coordinates("\n".join(linePoints))))
     wpFolder= KML.Folder(KML.name(routeName), routeLine,*wayPoints)
     doc.Document.append(wpFolder)
 
-def createKmlDoc(missionName, units):
+def exportLines(doc, lines):
+    """Append drawn lines from extractLines, each styled in its own colour."""
+    from sotn.lines import lineStyles
+
+    doc.Document.extend(lineStyles(lines))
+    for line in lines:
+        exportKml(doc, line, f'#{line.styleId}')
+
+def createKmlDoc(missionName, units, clusterRadius=None, gazetteer=None):
+    from pykml.factory import KML_ElementMaker as KML
+    from sotn.clustering import clusterPlacemark, clusterUnits
+
     styles = []
     natoCounters = []
     pactCounters = []
     neutralCounters = []
+    folders = {'NATO': natoCounters, 'Pact': pactCounters, 'Undefined': neutralCounters}
 
-    for unit in units:
-        imagePath = unit[0]['CustomImage']['ImageURL']
-        name = unit[0]['Nickname'].replace(' ','')
+    # with a radius, stacked counters of one folder become a single placemark
+    groups = clusterUnits(units, clusterRadius) if clusterRadius else [[unit] for unit in units]
+    # with a gazetteer, each placemark says where it is relative to the nearest town
+    locations = gazetteer.locate([group[0] for group in groups]) if gazetteer else [None] * len(groups)
+    for group, location in zip(groups, locations):
+        unit = group[0]
+        imagePath = unit.image
+        name = unit.name.replace(' ','')
         style = KML.Style(
                 KML.IconStyle(
                     KML.scale(1.7),
@@ -66,17 +118,16 @@ def createKmlDoc(missionName, units):
             )
         styles.append(style)
         key = name.replace(' ','')
-        placemark = KML.Placemark(KML.name(name),KML.styleUrl(f'#{key}'), toKmlPoint(unit[1]))
-        unitTags = unit[0].get('Tags')
-        if not unitTags:
-             neutralCounters.append(placemark)
-             continue
-        if 'NATO' in unitTags:
-            natoCounters.append(placemark)
-        if 'WP' in unitTags:
-            pactCounters.append(placemark)
-        if 'Marker' in unitTags:
-            neutralCounters.append(placemark)    
+        if len(group) > 1:
+            placemark = clusterPlacemark(group, key, location)
+        elif location:
+            placemark = KML.Placemark(KML.name(name), KML.description(str(location)), KML.styleUrl(f'#{key}'),
+                                      location.extendedData(), toKmlPoint(unit.pos))
+        else:
+            placemark = KML.Placemark(KML.name(name),KML.styleUrl(f'#{key}'), toKmlPoint(unit.pos))
+        counters = folders.get(unit.folder)
+        if counters is not None:
+            counters.append(placemark)
     
     natoFolder = KML.Folder(KML.name('NATO_TacMap'), *natoCounters)
     pactFolder = KML.Folder(KML.name('Pact_TacMap'), *pactCounters)
@@ -92,59 +143,136 @@ def createKmlDoc(missionName, units):
         )
     )
 
-path = 'SampleScenario.json'
-crs = GeoReferencedMap(path)
-
-with open(path) as ttsFile:
-    data = json.load(ttsFile)
-
-def is_hq_supply(obj):
-    """Return True if object's LuaScript contains HQ Supply (case-insensitive)."""
-    lua = obj.get('LuaScript') or obj.get('LuaScriptState') or ''
-    if not isinstance(lua, str):
-        return False
-    return 'hq supply' in lua.lower()
+def extractUnits(data, crs, classifier=None):
+    """Return a UnitRecord for every unit on the TacMap."""
+    classifier = classifier or classifierFor(LAYER)
+    units = []
+    candidates = []
+    for obj in data.get('ObjectStates', []):
+        # skip objects the rules exclude (e.g. HQ Supply tokens)
+        folder = classifier.classify(obj)
+        if folder == EXCLUDE:
+            continue
 
-units = []
-for obj in data.get('ObjectStates', []):
-    # skip HQ Supply tokens by lua-script marker
-    if is_hq_supply(obj):
-        continue
+        # custom tile/token items (units placed directly) and containers (e.g. a bag holding markers)
+        if obj.get('Name') in ('Custom_Tile', 'Custom_Token') or obj.get('ContainedObjects'):
+            candidates.append((obj, folder))
 
-    # handle top-level custom tile/token items (units placed directly)
-    if obj.get('Name') in ('Custom_Tile', 'Custom_Token'):
-        pos = crs.toLoLa(obj.get('Transform', {}))
+    # place every candidate with one vectorised bounds test
+    positions = crs.toLoLaMany([obj.get('Transform', {}) for obj, _ in candidates])
+    for (obj, folder), pos in zip(candidates, positions):
         if not pos:
             continue
-        units.append((obj, pos))
-        continue
-
-    # handle containers that have contained objects (e.g. a bag holding markers)
-    contained = obj.get('ContainedObjects') or []
-    if contained:
-        # use parent transform for contained items' world position
-        parent_transform = obj.get('Transform', {})
-        parent_pos = crs.toLoLa(parent_transform)
-        if not parent_pos:
+
+        # handle top-level custom tile/token items (units placed directly)
+        if obj.get('Name') in ('Custom_Tile', 'Custom_Token'):
+            units.append(UnitRecord.fromObject(obj, pos, folder=folder))
             continue
-        for c in contained:
-            # skip empty entries and HQ Supply tokens inside containers
-            if not isinstance(c, dict) or is_hq_supply(c):
-                continue
-            # prefer contained object's Tags; fall back to contained Name
-            tags = c.get('Tags') or []
-            # normalize tags for case-insensitive matching
-            tags_lower = [t.lower() for t in tags if isinstance(t, str)]
-            # consider any contained object that has tags we're interested in
-            if tags_lower:
-                # create a shallow copy so we can assign a Transform for style/metadata lookup
-                item = dict(c)
-                # give the contained object the parent's transform so crs.toLoLa works
-                item['Transform'] = parent_transform
-                units.append((item, parent_pos))
-   
-doc = createKmlDoc('Sample', units)
-with open('Sample.kml',"wb") as out:
-        out.write(etree.tostring(doc, pretty_print=True, encoding="utf-8"))
 
+        # handle containers that have contained objects (e.g. a bag holding markers)
+        contained = obj.get('ContainedObjects') or []
+        if contained:
+            # use parent transform for contained items' world position
+            parent_transform = obj.get('Transform', {})
+            for c in contained:
+                # skip empty entries and excluded objects inside containers
+                if not isinstance(c, dict):
+                    continue
+                folder = classifier.classify(c)
+                if folder == EXCLUDE:
+                    continue
+                # prefer contained object's Tags; fall back to contained Name
+                tags = c.get('Tags') or []
+                # normalize tags for case-insensitive matching
+                tags_lower = [t.lower() for t in tags if isinstance(t, str)]
+                # consider any contained object that has tags we're interested in
+                if tags_lower:
+                    # contained items take the parent's position and remember the parent
+                    units.append(UnitRecord.fromObject(c, pos, parent_transform, obj.get('GUID'), folder))
+    return units
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', nargs='?', default='SampleScenario.json')
+    parser.add_argument('--store', help='snapshot store directory to append the extracted units to')
+    parser.add_argument('--tiles', help='also write a Region/Lod tiled copy of the layer to this directory')
+    parser.add_argument('--tile-size', type=int, default=200, help='most units per tile before it is split')
+    parser.add_argument('--cluster', type=float, help='merge same-folder counters within this many metres into one placemark')
+    parser.add_argument('--geojson', help='also write GeoJSON FeatureCollections per faction to this directory')
+    parser.add_argument('--binary', help='also write the compact binary feature file to this directory')
+    parser.add_argument('--line-tolerance', type=float,
+                        help='simplify drawn lines to this many metres (default 50, 0 keeps every point)')
+    parser.add_argument('--no-lines', action='store_true', help='leave the drawn vector lines out')
+    parser.add_argument('--towns', nargs='?', const=TOWNS_FILE,
+                        help='label placemarks with distance and bearing from the nearest town (default: the layer\'s towns.lua)')
+    parser.add_argument('--density', help='also write per-faction density PNGs to this directory and overlay them')
+    parser.add_argument('--density-cells', type=int, default=256, help='density cells along the longer side of the layer')
+    parser.add_argument('--density-sigma', type=float, default=1.5, help='Gaussian smoothing in cells (0 for raw counts)')
+    parser.add_argument('--control', action='store_true', help='add NATO and Pact control areas and the front between them')
+    parser.add_argument('--control-cells', type=int, default=256, help='control grid cells along the longer side of the layer')
+    parser.add_argument('--control-reach', type=float, help='leave cells farther than this many km from any unit uncontrolled')
+    parser.add_argument('--publish', help='also write the outputs under content-hashed names to this directory and list them in its manifest.json')
+    args = parser.parse_args(argv)
+    from lxml import etree
+    from sotn.lines import DEFAULT_TOLERANCE, extractLines
+
+    data = jsonio.load(args.path)
+    crs = GeoReferencedMap()
+    crs.findMapTransform(data)
+
+    units = extractUnits(data, crs)
+    tolerance = DEFAULT_TOLERANCE if args.line_tolerance is None else args.line_tolerance
+    lines = [] if args.no_lines else extractLines(data, crs, tolerance)
+    # the records hold everything the outputs need; release the parsed save
+    del data
+    if args.store:
+        from sotn.snapshots import SnapshotStore, fileHash
+        store = SnapshotStore(args.store)
+        store.append(store.turnFor(fileHash(args.path)), LAYER, units)
+    if args.tiles:
+        from sotn.tiling import layerBounds, writeTiles
+        writeTiles(args.tiles, LAYER, units, layerBounds(crs), createKmlDoc, args.tile_size)
+    # files written besides the KML, for --publish
+    written = []
+    if args.geojson:
+        from sotn.features import writeGeoJson
+        written += writeGeoJson(args.geojson, LAYER, units)
+    if args.binary:
+        from sotn.features import writeBinary
+        written.append(writeBinary(args.binary, LAYER, units))
+    gazetteer = None
+    if args.towns:
+        from sotn.gazetteer import Gazetteer
+        gazetteer = Gazetteer.fromTownsLua(args.towns)
+    doc = createKmlDoc('Sample', units, args.cluster, gazetteer)
+    exportLines(doc, lines)
+    overlays = None
+    if args.density:
+        from sotn.density import groundOverlays, writeDensity
+        from sotn.tiling import layerBounds
+        bounds = layerBounds(crs)
+        paths = writeDensity(args.density, LAYER, units, bounds, args.density_cells, args.density_sigma)
+        overlays = groundOverlays(LAYER, paths, bounds)
+        doc.Document.append(overlays)
+    if args.control:
+        from sotn.control import controlAreas, exportControl
+        from sotn.tiling import layerBounds
+        reach = args.control_reach * 1000.0 if args.control_reach else None
+        exportControl(doc, LAYER, *controlAreas(units, layerBounds(crs), args.control_cells, reach))
+    with open('Sample.kml',"wb") as out:
+            out.write(etree.tostring(doc, pretty_print=True, encoding="utf-8"))
+    if args.publish:
+        from sotn.manifest import Manifest
+        manifest = Manifest(args.publish)
+        manifest.startLayer(LAYER, args.path, units)
+        for path in written:
+            manifest.addFile(LAYER, path)
+        if overlays is not None:
+            # the published KML points at the published PNGs
+            stamped = {folder: manifest.addFile(LAYER, path) for folder, path in paths.items()}
+            doc.Document.replace(overlays, groundOverlays(LAYER, stamped, bounds, args.publish))
+        manifest.add(LAYER, f'{LAYER}.kml', etree.tostring(doc, pretty_print=True, encoding="utf-8"))
+        manifest.save()
 
+if __name__ == '__main__':
+    main()
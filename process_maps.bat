@@ -23,7 +23,7 @@ copy "%SAVE_FILE%" "AnalyzeTTS-OpMap\TTS2KML\"
 REM Process each map
 echo Processing Tactical Map...
 cd AnalyzeTTS-TacMap\TTS2KML
-python TTS2KML.py "%SAVE_FILE%"
+python TTS2KML.py "%SAVE_FILE%" --store ..\..\snapshots --publish ..\..\publish
 if errorlevel 1 (
     echo Error processing Tactical Map
     cd ..\..
@@ -33,7 +33,7 @@ cd ..\..
 
 echo Processing Strategic Map...
 cd AnalyzeTTS-StratMap\TTS2KML
-python TTS2KML.py "%SAVE_FILE%"
+python TTS2KML.py "%SAVE_FILE%" --store ..\..\snapshots --publish ..\..\publish
 if errorlevel 1 (
     echo Error processing Strategic Map
     cd ..\..
@@ -43,7 +43,7 @@ cd ..\..
 
 echo Processing Operational Map...
 cd AnalyzeTTS-OpMap\TTS2KML
-python TTS2KML.py "%SAVE_FILE%"
+python TTS2KML.py "%SAVE_FILE%" --store ..\..\snapshots --publish ..\..\publish
 if errorlevel 1 (
     echo Error processing Operational Map
     cd ..\..
@@ -77,7 +77,7 @@ del "AnalyzeTTS-TacMap\TTS2KML\%SAVE_FILE%"
 del "AnalyzeTTS-StratMap\TTS2KML\%SAVE_FILE%"
 del "AnalyzeTTS-OpMap\TTS2KML\%SAVE_FILE%"
 
-echo Done! KML files have been generated.
+echo Done! KML files have been generated, hash-stamped copies and manifest.json in publish\.
 pause
 exit /b 0
 
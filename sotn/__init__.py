@@ -0,0 +1 @@
+"""Tools shared by the TacMap, StratMap and OpMap converters."""
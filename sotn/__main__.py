@@ -0,0 +1,59 @@
+"""Cold-start time of the command-line entry points.
+
+    python -m sotn [--repeat 5]
+
+Each command is started with --help in a fresh interpreter, the way a shell
+or a service starts it, and the best wall time of --repeat runs is shown
+with the heavy libraries the command imported before it could answer.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+from sotn.layers import LAYERS, ROOT, layerDir
+
+HEAVY = ('numpy', 'lxml', 'pykml', 'lupa', 'PIL', 'zstandard', 'orjson', 'simdjson')
+
+def commands():
+    python = sys.executable
+    entries = {'import sotn.api': [python, '-c', 'import sotn.api']}
+    for layer in LAYERS:
+        entries[f'{layer} TTS2KML.py'] = [python, os.path.join(layerDir(layer), 'TTS2KML.py'), '--help']
+        script = os.path.join(layerDir(layer, 'AnalyzeTTS'), 'AnalyzeTTS.py')
+        entries[f'{layer} AnalyzeTTS.py'] = [python, '-c', f'import runpy; runpy.run_path({script!r})']
+        script = os.path.join(layerDir(layer, 'Import'), 'Import.py')
+        entries[f'{layer} Import.py'] = [python, '-c', f'import runpy; runpy.run_path({script!r})']
+    for module in ('calibrate', 'diff', 'history', 'server', 'worker', 'snapshots'):
+        entries[f'sotn.{module}'] = [python, '-m', f'sotn.{module}', '--help']
+    return entries
+
+def heavyImports(command):
+    """Top-level packages from HEAVY that the command imports."""
+    result = subprocess.run(command[:1] + ['-X', 'importtime'] + command[1:], cwd=ROOT,
+                            capture_output=True, text=True)
+    names = {line.rsplit('|', 1)[-1].strip().split('.')[0] for line in result.stderr.splitlines()
+             if line.startswith('import time:')}
+    return [name for name in HEAVY if name in names]
+
+def coldStart(command, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5, help='runs per command; the fastest counts')
+    args = parser.parse_args(argv)
+    baseline = coldStart([sys.executable, '-c', 'pass'], args.repeat)
+    print(f"{'python -c pass':24s} {baseline * 1000:7.1f} ms")
+    for name, command in commands().items():
+        elapsed = coldStart(command, args.repeat)
+        print(f"{name:24s} {elapsed * 1000:7.1f} ms  {', '.join(heavyImports(command)) or '-'}")
+
+if __name__ == '__main__':
+    main()
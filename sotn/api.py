@@ -0,0 +1,31 @@
+"""Library entry points for embedding the converters in other programs.
+
+    from sotn.api import calibrate, convert
+    calibrate()                            # every layer's tts2lola.json
+    kml = convert('TS_Save_48.json')       # {'TacMap': b'<?xml ...', ...}
+
+Importing this module is cheap: numpy, lxml, pykml and lupa are imported
+by the functions that need them, on first call.
+"""
+from sotn.layers import LAYERS, convert, geoReferencedMap, renderLayer
+
+def calibrate(layers=LAYERS, save=None, bounds=None, outDir=None, seed=None):
+    """Fit and write tts2lola.json for every layer; returns {layer: validation report}."""
+    from sotn import calibrate as calibration
+
+    return calibration.calibrate(layers, save, bounds, outDir, seed)
+
+def diffSaves(oldPath, newPath, layers=LAYERS, minKm=0.05):
+    """{layer: {faction: moved, added, removed}} between two saves."""
+    from sotn import diff
+
+    return diff.diffSaves(oldPath, newPath, layers, minKm)
+
+def loadSave(path):
+    """Parse a save (plain, compressed or in a zip archive) and index it."""
+    from sotn import jsonio
+    from sotn.saveindex import SaveIndex
+
+    return SaveIndex(jsonio.load(path))
+
+__all__ = ['LAYERS', 'calibrate', 'convert', 'diffSaves', 'geoReferencedMap', 'loadSave', 'renderLayer']
@@ -0,0 +1,89 @@
+"""Pack card face images into TTS deck sheets.
+
+TTS draws a custom deck from grid images of up to 10x7 cards sharing one
+back (the card entries use BackIsHidden, so every cell can hold a card).
+Card images are read from local files only (plain paths or file:/// URLs)
+and scaled to the size of the first card; sheets are assembled as numpy
+arrays and encoded in parallel. Needs Pillow.
+"""
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlsplit
+
+import numpy as np
+
+COLUMNS, ROWS = 10, 7
+
+def localPath(url):
+    """Filesystem path of a card image URL; remote URLs are refused."""
+    parts = urlsplit(url)
+    if parts.scheme == 'file':
+        path = unquote(parts.netloc + parts.path)
+        # file:///C:\dir\card.png -> C:\dir\card.png
+        return path[1:] if len(path) > 2 and path[0] == '/' and path[2] == ':' else path
+    if len(parts.scheme) <= 1:
+        return url
+    raise ValueError(f'card image is not a local file: {url}')
+
+def fileUrl(path):
+    return 'file:///' + os.path.abspath(path).lstrip('/')
+
+def readImages(paths, size=None):
+    """(n, h, w, 4) uint8 array of the images, resized to size (w, h) or the first image's."""
+    from PIL import Image
+
+    cells = []
+    for path in paths:
+        with Image.open(localPath(path)) as image:
+            image = image.convert('RGBA')
+            size = size or image.size
+            if image.size != size:
+                image = image.resize(size, Image.LANCZOS)
+            cells.append(np.asarray(image))
+    return np.stack(cells)
+
+def assemble(cells, columns=COLUMNS, rows=ROWS):
+    """Lay (n, h, w, 4) cells out row-major on one sheet."""
+    n, h, w, depth = cells.shape
+    grid = np.zeros((rows * columns, h, w, depth), np.uint8)
+    grid[:n] = cells
+    return grid.reshape(rows, columns, h, w, depth).swapaxes(1, 2).reshape(rows * h, columns * w, depth)
+
+def writeSheet(path, faces, size, columns=COLUMNS, rows=ROWS):
+    from PIL import Image
+
+    sheet = assemble(readImages(faces, size), columns, rows)
+    Image.fromarray(sheet, 'RGBA').save(path, optimize=False)
+    return path
+
+def packDeck(directory, name, cards, columns=COLUMNS, rows=ROWS, workers=None, back=None):
+    """Write <name>_<n>.png sheets and <name>_back.png for (face, back) pairs.
+
+    Returns one {'FaceURL', 'BackURL', 'NumWidth', 'NumHeight', 'count'}
+    per sheet, in order; card i of sheet s is the i-th pair of that sheet.
+    The back is the first card back given, else `back`; a local one is
+    copied next to the sheets, a remote one referenced as is. A face is
+    never used as the back, since it would show on every hidden card.
+    """
+    faces = [face for face, _ in cards]
+    back = next((b for _, b in cards if b), back)
+    if not back:
+        raise ValueError(f'{name}: no card has a back image and no default back was given')
+    os.makedirs(directory, exist_ok=True)
+    size = tuple(readImages(faces[:1]).shape[2:0:-1])
+    try:
+        backPath = os.path.join(directory, f'{name}_back.png')
+        shutil.copyfile(localPath(back), backPath)
+        backUrl = fileUrl(backPath)
+    except ValueError:
+        backUrl = back
+
+    perSheet = columns * rows
+    chunks = [faces[i:i + perSheet] for i in range(0, len(faces), perSheet)]
+    paths = [os.path.join(directory, f'{name}_{s + 1}.png') for s in range(len(chunks))]
+    with ThreadPoolExecutor(workers) as pool:
+        list(pool.map(lambda job: writeSheet(*job, size, columns, rows), zip(paths, chunks)))
+    return [{'FaceURL': fileUrl(path), 'BackURL': backUrl,
+             'NumWidth': columns, 'NumHeight': rows, 'count': len(chunk)}
+            for path, chunk in zip(paths, chunks)]
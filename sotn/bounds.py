@@ -0,0 +1,67 @@
+"""Layer bounds: the SouthWest/NorthEast box of tts2lola.json, optionally a polygon.
+
+Bounds.json marks the usable part of a map with Chess_Pawn objects. Two
+pawns nicknamed 'SouthWest' and 'NorthEast' give an axis-aligned box; three
+or more pawns nicknamed 'Bound 1', 'Bound 2', ... give a polygon, taken in
+the order of their numbers, for maps that sit rotated on the table or that
+the quadratic fits warp. The polygon is stored as 'polygon' next to the box,
+which then becomes the polygon's bounding box, so tools that only read the
+box keep working. All points are map offsets in the converters' (z, x) order.
+
+insideBounds tests many points at once: the box rejects most outside points
+with four comparisons, and only the points inside it are tested against
+every polygon edge.
+"""
+import re
+
+import numpy as np
+
+POLYGON_PAWN = re.compile(r'^Bound\s*(\d+)$')
+
+def boundsFromPawns(corners):
+    """The 'bounds' entry of tts2lola.json from {pawn nickname: (z, x) offset}."""
+    numbered = []
+    for name, offset in corners.items():
+        match = POLYGON_PAWN.match(name.strip())
+        if match:
+            numbered.append((int(match.group(1)), offset))
+    bounds = {name: list(corners[name]) for name in ('NorthEast', 'SouthWest') if name in corners}
+    if len(numbered) >= 3:
+        polygon = np.array([offset for _, offset in sorted(numbered)], dtype=float)
+        bounds['polygon'] = polygon.tolist()
+        bounds['NorthEast'] = polygon.max(axis=0).tolist()
+        bounds['SouthWest'] = polygon.min(axis=0).tolist()
+    return bounds
+
+def relativeOffsets(mapTransform, posX, posZ):
+    """The converters' relativeOffset for arrays of world positions: (z, x) offset arrays."""
+    x = (np.asarray(posX, dtype=float) - mapTransform['posX']) / mapTransform['scaleX']
+    z = (np.asarray(posZ, dtype=float) - mapTransform['posZ']) / mapTransform['scaleZ']
+    return z, x
+
+def pointInPolygon(polygon, x, y):
+    """Crossing-number test of the points (x, y) against all edges of polygon at once."""
+    px, py = polygon[:, 0], polygon[:, 1]
+    qx, qy = np.roll(px, -1), np.roll(py, -1)
+    x, y = x[:, None], y[:, None]
+    crosses = (py > y) != (qy > y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        atX = px + (y - py) * (qx - px) / (qy - py)
+    return np.count_nonzero(crosses & (x < atX), axis=1) % 2 == 1
+
+def insideBounds(bounds, x, y):
+    """Boolean array: which of the offsets (x, y) lie inside the layer's bounds."""
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    (x0, y0), (x1, y1) = bounds['SouthWest'], bounds['NorthEast']
+    inside = (x >= x0) & (x <= x1) & (y >= y0) & (y <= y1)
+    if 'polygon' in bounds and inside.any():
+        candidates = np.flatnonzero(inside)
+        inside[candidates] = pointInPolygon(np.array(bounds['polygon'], dtype=float), x[candidates], y[candidates])
+    return inside
+
+def outline(bounds):
+    """Corners around the bounds: the polygon, or the box's four corners."""
+    if 'polygon' in bounds:
+        return np.array(bounds['polygon'], dtype=float)
+    (x0, y0), (x1, y1) = bounds['SouthWest'], bounds['NorthEast']
+    return np.array([(x0, y0), (x1, y0), (x1, y1), (x0, y1)], dtype=float)
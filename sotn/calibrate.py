@@ -0,0 +1,242 @@
+"""Calibrate all map layers in one run.
+
+Each distinct input file is parsed once: a save or Bounds.json shared by
+several layers (--save / --bounds) is read a single time, and towns.lua
+files are read through one Lua runtime into plain dicts. City markers and
+bound pawns are matched to every map in one pass over the objects; when a
+file holds more than one map, each object goes to the map whose footprint
+(the bounds of the layer's current tts2lola.json) contains it, the one it
+is closest to relative to the footprint's size breaking ties. A city
+marker outside every footprint is dropped; a bound pawn, which may move the
+footprint, goes to the nearest map. The layers are then fitted in parallel and every tts2lola.json (and
+its validation report) is replaced atomically:
+
+    python -m sotn.calibrate                              # each layer's own TTS.json / Bounds.json
+    python -m sotn.calibrate --save Calibration.json --bounds Bounds.json
+
+The fits are the ones the per-layer AnalyzeTTS.py scripts use: scale and
+offset for TacMap, a RANSAC 2D quadratic for StratMap and OpMap.
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from sotn import jsonio
+from sotn.bounds import boundsFromPawns, insideBounds
+from sotn.layers import LAYERS, geoReferencedMap, layerDir
+from sotn.saveindex import SaveIndex, nicknameKey
+from sotn.validation import validationReport, writeReport
+
+MODELS = {'TacMap': 'linear', 'StratMap': 'quadratic', 'OpMap': 'quadratic'}
+MAP_NAMES = {
+    'TacMap': ('TacMap', 'Tactical Map - Test', 'Tactical Map', 'TacticalMap'),
+    'StratMap': ('StratMap',),
+    'OpMap': ('OpMap',),
+}
+
+def loadTowns(paths):
+    """{path: {town: (longitude, latitude)}}, one Lua runtime for all files."""
+    from lupa.lua54 import LuaRuntime
+
+    lua = LuaRuntime(unpack_returned_tuples=True)
+    towns = {}
+    for path in paths:
+        lua.globals().towns = None
+        lua.globals().loadfile(path)()
+        towns[path] = {name: (town['longitude'], town['latitude'])
+                       for name, town in lua.globals().towns.items()}
+    return towns
+
+def findMap(index, names):
+    mapObject = index.first(names)
+    return mapObject['Transform'] if mapObject else None
+
+def relativeOffset(objectTransform, mapTransform):
+    """(z, x) of an object in map units, the order the converters use."""
+    x = (objectTransform['posX'] - mapTransform['posX']) / mapTransform['scaleX']
+    z = (objectTransform['posZ'] - mapTransform['posZ']) / mapTransform['scaleZ']
+    return (z, x)
+
+def footprint(layer):
+    """The bounds the layer's converter accepts, or None without a tts2lola.json."""
+    try:
+        return geoReferencedMap(layer).data['bounds']
+    except (OSError, KeyError):
+        return None
+
+def footprintDistance(offset, bounds):
+    """Distance of offset from the centre of bounds, in half-sizes of bounds (1 at its edge)."""
+    if bounds is None:
+        return max(map(abs, offset))
+    (z0, x0), (z1, x1) = bounds['SouthWest'], bounds['NorthEast']
+    return max(abs(2 * offset[0] - z0 - z1) / max(z1 - z0, 1e-9),
+               abs(2 * offset[1] - x0 - x1) / max(x1 - x0, 1e-9))
+
+def assignToMaps(objects, maps, accept, footprints=None, inside=False):
+    """Yield (layer, obj, offset) for objects accept(layer, obj) takes.
+
+    An object goes to the map whose footprint contains it; among several
+    (or none), to the one it is nearest to relative to the footprint size.
+    With inside, objects no footprint contains are left out; a layer
+    without a footprint contains everything.
+    """
+    footprints = footprints or {}
+    for obj in objects:
+        if not obj.get('Transform'):
+            continue
+        candidates = [layer for layer in maps if accept(layer, obj)]
+        if not candidates:
+            continue
+        offsets = {layer: relativeOffset(obj['Transform'], maps[layer]) for layer in candidates}
+        containing = [layer for layer in candidates if footprints.get(layer) is None
+                      or insideBounds(footprints[layer], *np.array([offsets[layer]]).T)[0]]
+        if inside and not containing:
+            continue
+        layer = min(containing or candidates, key=lambda l: footprintDistance(offsets[l], footprints.get(l)))
+        yield layer, obj, offsets[layer]
+
+def townName(nickname, towns):
+    """Town a (SaveIndex-normalised) nickname refers to, if any."""
+    for candidate in (nickname, nickname.replace('_', ' ')):
+        if candidate in towns:
+            return candidate
+    return None
+
+def design(offsets, model):
+    """Design matrices (longitude, latitude) of the layer's model."""
+    z, x = offsets[:, 0], offsets[:, 1]
+    if model == 'linear':
+        return np.column_stack([z, np.ones_like(z)]), np.column_stack([x, np.ones_like(x)])
+    quadratic = np.column_stack([z * z, x * x, z * x, z, x, np.ones_like(z)])
+    return quadratic, quadratic
+
+def ransac(X, y, rng, iterations=200, threshold=0.01):
+    """(coefficients, inlier mask): least squares on the largest consensus set of random minimal samples."""
+    n, k = X.shape
+    samples = np.array([rng.choice(n, k, replace=False) for _ in range(iterations)])
+    A, b = X[samples], y[samples]
+    solvable = np.abs(np.linalg.det(A)) > 1e-12
+    coefficients = np.linalg.solve(A[solvable], b[solvable][..., None])[..., 0]
+    inliers = np.abs(X @ coefficients.T - y[:, None]) < threshold
+    best = inliers[:, np.argmax(inliers.sum(axis=0))] if len(coefficients) else np.zeros(n, bool)
+    if best.sum() < k:
+        best = np.ones(n, bool)
+    return np.linalg.lstsq(X[best], y[best], rcond=None)[0], best
+
+def fitLayer(layer, offsets, lonLat, seed=None):
+    """Worker process: (easting, northing, inlier masks) of one layer; the masks are None without RANSAC."""
+    model = MODELS[layer]
+    designs = design(offsets, model)
+    if model == 'linear':
+        easting, northing = (np.linalg.lstsq(X, lonLat[:, i], rcond=None)[0] for i, X in enumerate(designs))
+        return easting, northing, None
+    rng = np.random.default_rng(seed)
+    (easting, lonInliers), (northing, latInliers) = (ransac(X, lonLat[:, i], rng) for i, X in enumerate(designs))
+    return easting, northing, (lonInliers, latInliers)
+
+def transformData(layer, easting, northing, corners):
+    if MODELS[layer] == 'linear':
+        return {
+            'easting': {'scale': float(easting[0]), 'offset': float(easting[1])},
+            'northing': {'scale': float(northing[0]), 'offset': float(northing[1])},
+            'bounds': boundsFromPawns(corners),
+        }
+    keys = 'abcdef'
+    return {
+        'easting': dict(zip(keys, map(float, easting))),
+        'northing': dict(zip(keys, map(float, northing))),
+        'bounds': boundsFromPawns(corners),
+    }
+
+def atomicDump(obj, path, indent=4):
+    tmp = path + '.tmp'
+    jsonio.dump(obj, tmp, indent=indent)
+    os.replace(tmp, path)
+
+def calibrate(layers=LAYERS, save=None, bounds=None, outDir=None, seed=None):
+    """Fit and write tts2lola.json for every layer; returns {layer: validation report}."""
+    folders = {layer: layerDir(layer, 'AnalyzeTTS') for layer in layers}
+    savePaths = {layer: save or os.path.join(folders[layer], 'TTS.json') for layer in layers}
+    boundsPaths = {layer: bounds or os.path.join(folders[layer], 'Bounds.json') for layer in layers}
+    townPaths = {layer: os.path.join(folders[layer], 'towns.lua') for layer in layers}
+
+    parsed = {path: SaveIndex(jsonio.load(path)) for path in {*savePaths.values(), *boundsPaths.values()}}
+    towns = loadTowns(set(townPaths.values()))
+    layerTowns = {layer: towns[townPaths[layer]] for layer in layers}
+    footprints = {layer: footprint(layer) for layer in layers}
+
+    markers = {layer: [] for layer in layers}
+    corners = {layer: {} for layer in layers}
+    mapless = {}
+    for path, index in parsed.items():
+        for kind, paths in (('markers', savePaths), ('bounds', boundsPaths)):
+            maps = {layer: findMap(index, MAP_NAMES[layer]) for layer in layers if paths[layer] == path}
+            for layer in [l for l, m in maps.items() if m is None]:
+                del maps[layer]
+                mapless[layer] = path
+            if kind == 'markers':
+                # one town lookup per distinct nickname in the save
+                named = {key: {layer: townName(key, layerTowns[layer]) for layer in maps}
+                         for key in index.byNickname}
+                candidates = [obj for key, towns in named.items() if any(towns.values())
+                              for obj in index.withNickname(key, topLevel=True)]
+                townOf = lambda layer, obj: named[nicknameKey(obj['Nickname'])][layer]
+                for layer, obj, offset in assignToMaps(candidates, maps, townOf, footprints, inside=True):
+                    markers[layer].append((townOf(layer, obj), offset))
+            else:
+                pawns = [obj for obj in index.withName('Chess_Pawn', topLevel=True) if obj.get('Nickname')]
+                for layer, obj, offset in assignToMaps(pawns, maps, lambda layer, obj: True, footprints):
+                    corners[layer][obj['Nickname']] = offset
+
+    inputs = {}
+    for layer in layers:
+        if layer in mapless:
+            print(f"{layer}: skipped, map not found in {mapless[layer]}, nicknames tried: {MAP_NAMES[layer]}")
+            continue
+        needed = 6 if MODELS[layer] == 'quadratic' else 2
+        missing = {'NorthEast', 'SouthWest'} - set(boundsFromPawns(corners[layer]))
+        if len(markers[layer]) < needed or missing:
+            print(f"{layer}: skipped, {len(markers[layer])} city markers (need {needed})"
+                  + (f", bound pawns missing: {sorted(missing)} (or 'Bound 1'..'Bound N')" if missing else ''))
+            continue
+        names = [name for name, _ in markers[layer]]
+        offsets = np.array([offset for _, offset in markers[layer]], dtype=float)
+        lonLat = np.array([layerTowns[layer][name] for name in names], dtype=float)
+        inputs[layer] = (names, offsets, lonLat)
+        print(f"{layer}: {len(names)} city markers")
+
+    with ProcessPoolExecutor(max(1, len(inputs))) as pool:
+        futures = {layer: pool.submit(fitLayer, layer, offsets, lonLat, seed)
+                   for layer, (names, offsets, lonLat) in inputs.items()}
+        fits = {layer: future.result() for layer, future in futures.items()}
+
+    reports = {}
+    for layer, (names, offsets, lonLat) in inputs.items():
+        directory = outDir or folders[layer]
+        path = os.path.join(directory, 'tts2lola.json') if outDir is None else os.path.join(directory, f'{layer}_tts2lola.json')
+        easting, northing, inliers = fits[layer]
+        atomicDump(transformData(layer, easting, northing, corners[layer]), path)
+        # what the converter will actually compute from the file just written
+        crs = geoReferencedMap(layer, path)
+        predicted = [crs.relativeToLoLa(z, x) for z, x in offsets]
+        reports[layer] = validationReport(layer, names, design(offsets, MODELS[layer]), lonLat, predicted,
+                                          inliers=inliers)
+        writeReport(reports[layer], path.replace('tts2lola.json', 'tts2lola_validation.json'))
+    return reports
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--layers', nargs='+', default=list(LAYERS), choices=LAYERS)
+    parser.add_argument('--save', help='one calibration save for all layers (default: each layer\'s TTS.json)')
+    parser.add_argument('--bounds', help='one bounds save for all layers (default: each layer\'s Bounds.json)')
+    parser.add_argument('--out-dir', help='write <Layer>_tts2lola.json here instead of into the layer folders')
+    parser.add_argument('--seed', type=int, help='RANSAC seed, for reproducible fits')
+    args = parser.parse_args(argv)
+    if args.out_dir:
+        os.makedirs(args.out_dir, exist_ok=True)
+    calibrate(args.layers, args.save, args.bounds, args.out_dir, args.seed)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Declarative unit classification shared by all layers.
+
+classification.json holds an ordered list of rules; the first rule whose
+conditions all hold decides the unit's folder, or drops the unit when it
+says "exclude". A rule may test:
+
+    "tags":     every listed tag is present (compiled to a bitmask)
+    "untagged": the object has no tags
+    "nickname": regular expression searched in the nickname
+    "script":   case-insensitive markers in LuaScript / LuaScriptState
+    "layers":   only apply on these layers
+
+All script markers are compiled into one regex and the markers found in a
+script are memoised per script text, so identical scripts on hundreds of
+counters are only scanned once.
+"""
+import os
+import re
+from functools import lru_cache
+
+from sotn import jsonio
+from sotn.records import tagMask
+
+RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'classification.json')
+EXCLUDE = 'exclude'
+
+class Rule:
+    __slots__ = ('tags', 'untagged', 'nickname', 'script', 'folder')
+
+    def __init__(self, spec):
+        self.tags = tagMask(spec.get('tags'))
+        self.untagged = spec.get('untagged', False)
+        self.nickname = re.compile(spec['nickname']) if spec.get('nickname') else None
+        self.script = frozenset(marker.lower() for marker in spec.get('script', ()))
+        self.folder = EXCLUDE if spec.get('exclude') else spec.get('folder')
+
+    def matches(self, tags, nickname, markers):
+        if self.tags and tags & self.tags != self.tags:
+            return False
+        if self.untagged and tags:
+            return False
+        if self.nickname is not None and not self.nickname.search(nickname):
+            return False
+        if self.script and not self.script & markers:
+            return False
+        return True
+
+class Classifier:
+    def __init__(self, rules, layer):
+        self.rules = [Rule(spec) for spec in rules if layer in spec.get('layers', [layer])]
+        markers = sorted({marker for rule in self.rules for marker in rule.script}, key=len, reverse=True)
+        self.scriptPattern = re.compile('|'.join(map(re.escape, markers)), re.IGNORECASE) if markers else None
+        self._scripts = {}
+
+    def markers(self, obj):
+        if self.scriptPattern is None:
+            return frozenset()
+        lua = obj.get('LuaScript') or obj.get('LuaScriptState') or ''
+        if not isinstance(lua, str) or not lua:
+            return frozenset()
+        found = self._scripts.get(lua)
+        if found is None:
+            found = self._scripts[lua] = frozenset(m.group(0).lower() for m in self.scriptPattern.finditer(lua))
+        return found
+
+    def classify(self, obj, tags=None):
+        """Folder name for a TTS object, EXCLUDE to drop it, or None when no rule matches."""
+        if tags is None:
+            tags = tagMask(obj.get('Tags'))
+        nickname = obj.get('Nickname') or ''
+        markers = self.markers(obj)
+        for rule in self.rules:
+            if rule.matches(tags, nickname, markers):
+                return rule.folder
+        return None
+
+@lru_cache(maxsize=None)
+def classifierFor(layer, path=RULES_FILE):
+    return Classifier(jsonio.load(path)['rules'], layer)
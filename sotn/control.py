@@ -0,0 +1,242 @@
+"""Faction control areas and the contested front, derived from unit positions.
+
+The layer's bounds box is rasterised and every cell goes to the faction of
+its nearest NATO or Pact unit: a discrete Voronoi partition computed by
+jump flooding, log2(cells) vectorised passes that each compare every cell
+with nine candidates, so the cost does not grow with the number of units.
+The edges between differently owned cells are then traced into rings (the
+control polygons) and into chains between NATO and Pact cells (the front),
+and both are simplified with Douglas-Peucker.
+"""
+import numpy as np
+from pykml.factory import KML_ElementMaker as KML
+
+from sotn.density import gridShape
+from sotn.lines import simplify
+from sotn.records import toArrays
+from sotn.validation import EARTH_RADIUS_M
+
+FACTIONS = ('NATO', 'Pact')
+FILL_COLOURS = {'NATO': '50ff7f00', 'Pact': '500000ff'}
+FRONT_COLOUR = 'ff00ffff'
+DEFAULT_CELLS = 256
+LEFT_TURN = {(0, 1): (1, 0), (1, 0): (0, -1), (0, -1): (-1, 0), (-1, 0): (0, 1)}
+
+def shifted(a, dy, dx, fill):
+    """out[i, j] = a[i + dy, j + dx], fill outside the grid."""
+    rows, columns = a.shape
+    out = np.full_like(a, fill)
+    if abs(dy) >= rows or abs(dx) >= columns:
+        return out
+    out[max(0, -dy):rows - max(0, dy), max(0, -dx):columns - max(0, dx)] = \
+        a[max(0, dy):rows + min(0, dy), max(0, dx):columns + min(0, dx)]
+    return out
+
+def jumpFlood(seeds, cellSize):
+    """(row, column) of the nearest seed cell for every cell, and its distance in metres."""
+    rows, columns = seeds.shape
+    height, width = cellSize
+    iy, ix = np.indices(seeds.shape)
+    seedY, seedX = np.where(seeds, iy, -1), np.where(seeds, ix, -1)
+    best = np.where(seeds, 0.0, np.inf)
+    step = 1 << max(0, (max(rows, columns) - 1).bit_length() - 1)
+    # a final extra pass of step 1 fixes most of jump flooding's misassignments
+    steps = []
+    while step:
+        steps.append(step)
+        step //= 2
+    for step in steps + [1]:
+        for dy in (-step, 0, step):
+            for dx in (-step, 0, step):
+                if not dy and not dx:
+                    continue
+                candidateY, candidateX = shifted(seedY, dy, dx, -1), shifted(seedX, dy, dx, -1)
+                distance = np.hypot((candidateY - iy) * height, (candidateX - ix) * width)
+                better = (candidateY >= 0) & (distance < best)
+                seedY[better], seedX[better], best[better] = candidateY[better], candidateX[better], distance[better]
+    return seedY, seedX, best
+
+def ownership(units, bounds, cells=DEFAULT_CELLS, reach=None):
+    """Grid of faction indices into FACTIONS (-1 for no owner), row 0 to the south, and the cell size in metres."""
+    west, south, east, north = bounds
+    rows, columns = gridShape(bounds, cells)
+    k = np.pi / 180.0 * EARTH_RADIUS_M
+    cellSize = ((north - south) / rows * k, (east - west) / columns * k * np.cos(np.radians((south + north) / 2)))
+    positions = toArrays(units)
+    folders = np.array([unit.folder or '' for unit in units])
+    counts = np.stack([
+        np.histogram2d(positions['lat'][folders == faction], positions['lon'][folders == faction],
+                       bins=(rows, columns), range=((south, north), (west, east)))[0]
+        for faction in FACTIONS
+    ])
+    seeds = counts.sum(axis=0) > 0
+    owners = np.full((rows, columns), -1)
+    if not seeds.any():
+        return owners, cellSize
+    # a cell holding units of both factions goes to the one with more
+    seedOwner = np.argmax(counts, axis=0)
+    seedY, seedX, distance = jumpFlood(seeds, cellSize)
+    owners = seedOwner[seedY, seedX]
+    if reach:
+        owners[distance > reach] = -1
+    return owners, cellSize
+
+def boundaryEdges(mask):
+    """Directed cell edges around mask, interior on the left, as (start, end) corner pairs."""
+    padded = np.pad(mask, 1)
+    inside = padded[1:-1, 1:-1]
+    edges = []
+    # (outside neighbour, start corner, end corner) for the bottom, right, top and left edges
+    for neighbour, start, end in (
+        (padded[:-2, 1:-1], (0, 0), (0, 1)),
+        (padded[1:-1, 2:], (0, 1), (1, 1)),
+        (padded[2:, 1:-1], (1, 1), (1, 0)),
+        (padded[1:-1, :-2], (1, 0), (0, 0)),
+    ):
+        i, j = np.nonzero(inside & ~neighbour)
+        edges += zip(zip((i + start[0]).tolist(), (j + start[1]).tolist()),
+                     zip((i + end[0]).tolist(), (j + end[1]).tolist()))
+    return edges
+
+def traceRings(mask):
+    """Closed rings of corners around mask: outer boundaries counter-clockwise, holes clockwise."""
+    outgoing = {}
+    for start, end in boundaryEdges(mask):
+        outgoing.setdefault(start, []).append(end)
+    rings = []
+    while outgoing:
+        start = next(iter(outgoing))
+        ring = [start]
+        previous, vertex = None, start
+        while True:
+            ends = outgoing[vertex]
+            end = ends[0]
+            if len(ends) > 1 and previous is not None:
+                # where two cells touch at a corner, keep to the cell being followed
+                heading = (vertex[0] - previous[0], vertex[1] - previous[1])
+                turn = LEFT_TURN[heading]
+                end = next((e for e in ends if (e[0] - vertex[0], e[1] - vertex[1]) == turn), end)
+            ends.remove(end)
+            if not ends:
+                del outgoing[vertex]
+            ring.append(end)
+            previous, vertex = vertex, end
+            if vertex == start:
+                break
+        rings.append(np.array(ring, dtype=float))
+    return rings
+
+def signedArea(ring):
+    y, x = ring[:, 0], ring[:, 1]
+    return 0.5 * float(np.sum(x[:-1] * y[1:] - x[1:] * y[:-1]))
+
+def contains(ring, point):
+    """Ray casting over all edges of ring at once."""
+    y, x = ring[:, 0], ring[:, 1]
+    py, px = point
+    crosses = (y[:-1] > py) != (y[1:] > py)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        atX = x[:-1] + (py - y[:-1]) * (x[1:] - x[:-1]) / (y[1:] - y[:-1])
+    return bool(np.count_nonzero(crosses & (px < atX)) % 2)
+
+def frontChains(owners):
+    """Chains of corners along the edges between NATO and Pact cells."""
+    a, b = FACTIONS.index('NATO'), FACTIONS.index('Pact')
+    def contested(p, q):
+        return ((p == a) & (q == b)) | ((p == b) & (q == a))
+    neighbours = {}
+    def link(u, v):
+        neighbours.setdefault(u, []).append(v)
+        neighbours.setdefault(v, []).append(u)
+    i, j = np.nonzero(contested(owners[:, :-1], owners[:, 1:]))
+    for r, c in zip(i.tolist(), j.tolist()):
+        link((r, c + 1), (r + 1, c + 1))
+    i, j = np.nonzero(contested(owners[:-1], owners[1:]))
+    for r, c in zip(i.tolist(), j.tolist()):
+        link((r + 1, c), (r + 1, c + 1))
+
+    chains = []
+    # start at ends and junctions first, so closed loops are the only chains started mid-way
+    order = sorted(neighbours, key=lambda v: len(neighbours[v]) == 2)
+    for start in order:
+        while neighbours.get(start):
+            chain = [start]
+            vertex = start
+            while neighbours.get(vertex):
+                following = neighbours[vertex].pop()
+                neighbours[following].remove(vertex)
+                chain.append(following)
+                vertex = following
+                if len(neighbours[vertex]) != 1:
+                    break
+            chains.append(np.array(chain, dtype=float))
+    return chains
+
+def toLonLat(corners, bounds, shape, cellSize, tolerance):
+    """Simplified (lon, lat) points of corner coordinates."""
+    west, south, east, north = bounds
+    rows, columns = shape
+    # only the corners where the staircase turns matter; drop the rest before simplifying
+    step = np.diff(corners, axis=0)
+    turns = np.flatnonzero(np.any(step[1:] != step[:-1], axis=1)) + 1
+    corners = corners[np.concatenate([[0], turns, [len(corners) - 1]])]
+    kept = simplify(corners * cellSize, tolerance) if len(corners) > 2 else np.arange(len(corners))
+    if corners[0].tolist() == corners[-1].tolist() and len(kept) < 4:
+        kept = np.arange(len(corners))
+    lat = south + corners[kept, 0] / rows * (north - south)
+    lon = west + corners[kept, 1] / columns * (east - west)
+    return list(zip(lon.tolist(), lat.tolist()))
+
+def controlAreas(units, bounds, cells=DEFAULT_CELLS, reach=None):
+    """({faction: [(outer, [holes])]}, front chains), all as lists of (lon, lat)."""
+    owners, cellSize = ownership(units, bounds, cells, reach)
+    cellSize = np.array(cellSize)
+    tolerance = 1.5 * float(cellSize.max())
+    convert = lambda corners: toLonLat(corners, bounds, owners.shape, cellSize, tolerance)
+    areas = {}
+    for number, faction in enumerate(FACTIONS):
+        rings = traceRings(owners == number)
+        outers = sorted((ring for ring in rings if signedArea(ring) > 0), key=signedArea)
+        polygons = [(ring, []) for ring in outers]
+        for hole in (ring for ring in rings if signedArea(ring) < 0):
+            # centre of the cell to the right of the hole's first edge, which the hole encloses
+            dy, dx = hole[1] - hole[0]
+            inside = hole[0] + 0.5 * np.array([dy - dx, dx + dy])
+            # the smallest outer ring around it is the one the hole belongs to
+            owner = next((holes for outer, holes in polygons if contains(outer, inside)), None)
+            if owner is not None:
+                owner.append(hole)
+        if polygons:
+            areas[faction] = [(convert(outer), [convert(hole) for hole in holes]) for outer, holes in polygons]
+    return areas, [convert(chain) for chain in frontChains(owners)]
+
+def coordinates(points):
+    return KML.coordinates(' '.join(f'{lon},{lat}' for lon, lat in points))
+
+def exportControl(doc, layer, areas, front):
+    """Append a Control_<layer> folder: one filled MultiGeometry per faction and the front line."""
+    doc.Document.extend([
+        *[KML.Style(KML.LineStyle(KML.color('ff' + colour[2:]), KML.width(1)),
+                    KML.PolyStyle(KML.color(colour)), id=f'control{faction}')
+          for faction, colour in FILL_COLOURS.items()],
+        KML.Style(KML.LineStyle(KML.color(FRONT_COLOUR), KML.width(3)), id='controlFront'),
+    ])
+    placemarks = [
+        KML.Placemark(
+            KML.name(f'{faction} control'),
+            KML.styleUrl(f'#control{faction}'),
+            KML.MultiGeometry(*[
+                KML.Polygon(
+                    KML.outerBoundaryIs(KML.LinearRing(coordinates(outer))),
+                    *[KML.innerBoundaryIs(KML.LinearRing(coordinates(hole))) for hole in holes],
+                ) for outer, holes in polygons
+            ]),
+        ) for faction, polygons in areas.items()
+    ]
+    if front:
+        placemarks.append(KML.Placemark(
+            KML.name('Front'),
+            KML.styleUrl('#controlFront'),
+            KML.MultiGeometry(*[KML.LineString(KML.tessellate(1), coordinates(chain)) for chain in front]),
+        ))
+    doc.Document.append(KML.Folder(KML.name(f'Control_{layer}'), *placemarks))
@@ -0,0 +1,94 @@
+"""Per-faction unit density as coloured PNG GroundOverlays.
+
+Positions are binned once per folder with numpy.histogram2d over the
+layer's bounds box (the same lon/lat box tiling uses), optionally smoothed
+with a separable Gaussian, and written as an RGBA image whose opacity
+follows the density. All folders of a layer share one scale, so equal
+colour means an equal number of counters per cell.
+"""
+import os
+
+import numpy as np
+from pykml.factory import KML_ElementMaker as KML
+
+from sotn.records import toArrays
+
+COLOURS = {'NATO': (0, 127, 255), 'Pact': (255, 0, 0), 'Undefined': (255, 255, 0)}
+DEFAULT_CELLS = 256
+DEFAULT_SIGMA = 1.5
+
+def gridShape(bounds, cells):
+    """(rows, columns) with `cells` along the longer side of the box, roughly square cells."""
+    west, south, east, north = bounds
+    width = (east - west) * np.cos(np.radians((south + north) / 2))
+    height = north - south
+    if width >= height:
+        return max(1, int(round(cells * height / width))), cells
+    return cells, max(1, int(round(cells * width / height)))
+
+def gaussianKernel(sigma):
+    radius = max(1, int(np.ceil(3 * sigma)))
+    kernel = np.exp(-0.5 * (np.arange(-radius, radius + 1) / sigma) ** 2)
+    return kernel / kernel.sum()
+
+def smooth(grid, sigma):
+    """Separable Gaussian blur; each pass is a weighted sum of shifted copies."""
+    kernel = gaussianKernel(sigma)
+    radius = len(kernel) // 2
+    for axis in (0, 1):
+        pad = [(0, 0), (0, 0)]
+        pad[axis] = (radius, radius)
+        padded = np.pad(grid, pad)
+        n = grid.shape[axis]
+        grid = sum(w * np.take(padded, np.arange(i, i + n), axis=axis) for i, w in enumerate(kernel))
+    return grid
+
+def densityGrids(units, bounds, cells=DEFAULT_CELLS, sigma=DEFAULT_SIGMA):
+    """{folder: counts per cell}, row 0 to the north, for every folder that has units."""
+    west, south, east, north = bounds
+    rows, columns = gridShape(bounds, cells)
+    positions = toArrays(units)
+    folders = np.array([unit.folder or '' for unit in units])
+    grids = {}
+    for folder in COLOURS:
+        mask = folders == folder
+        if not mask.any():
+            continue
+        grid, _, _ = np.histogram2d(positions['lat'][mask], positions['lon'][mask],
+                                    bins=(rows, columns), range=((south, north), (west, east)))
+        grids[folder] = smooth(grid, sigma)[::-1] if sigma > 0 else grid[::-1]
+    return grids
+
+def colourise(grid, colour, scale):
+    """RGBA uint8 image: the folder's colour, opacity rising with density up to scale."""
+    alpha = np.sqrt(np.clip(grid / scale, 0.0, 1.0)) if scale > 0 else np.zeros_like(grid)
+    image = np.empty(grid.shape + (4,), dtype=np.uint8)
+    image[..., :3] = colour
+    image[..., 3] = np.round(alpha * 220).astype(np.uint8)
+    return image
+
+def writeDensity(directory, layer, units, bounds, cells=DEFAULT_CELLS, sigma=DEFAULT_SIGMA):
+    """Write <layer>_<folder>_density.png for each folder; returns {folder: path}."""
+    from PIL import Image
+
+    os.makedirs(directory, exist_ok=True)
+    grids = densityGrids(units, bounds, cells, sigma)
+    scale = max((grid.max() for grid in grids.values()), default=0.0)
+    paths = {}
+    for folder, grid in grids.items():
+        path = os.path.join(directory, f'{layer}_{folder}_density.png')
+        Image.fromarray(colourise(grid, COLOURS[folder], scale), 'RGBA').save(path)
+        paths[folder] = path
+    return paths
+
+def groundOverlays(layer, paths, bounds, relativeTo='.'):
+    """A folder of GroundOverlays over the bounds box, hrefs relative to the KML's directory."""
+    west, south, east, north = bounds
+    return KML.Folder(
+        KML.name(f'Density_{layer}'),
+        *[KML.GroundOverlay(
+            KML.name(f'{folder} density'),
+            KML.Icon(KML.href(os.path.relpath(path, relativeTo).replace(os.sep, '/'))),
+            KML.LatLonBox(KML.north(north), KML.south(south), KML.east(east), KML.west(west)),
+        ) for folder, path in paths.items()]
+    )
@@ -0,0 +1,143 @@
+"""What moved, appeared and disappeared between two saves, per layer and faction.
+
+Both saves go through the layers' own extractUnits in two worker processes,
+which hand back only a compact form (keys, names, folders and a lon/lat
+array); the join is a single dict pass over those:
+
+    python -m sotn.diff turn041.json turn042.json --json diff.json --kml-dir arrows
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from sotn import jsonio
+from sotn.history import unitKey
+from sotn.layers import LAYERS, geoReferencedMap, loadConverter
+from sotn.saveindex import SaveIndex
+from sotn.validation import metres
+
+ARROW_COLOURS = {'NATO': 'ffff7f00', 'Pact': 'ff0000ff', 'Undefined': 'ff00ffff'}
+
+class Extract:
+    """The units of one layer of one save, reduced to what a diff needs."""
+    __slots__ = ('keys', 'names', 'folders', 'lonLat')
+
+    def __init__(self, units):
+        # units in no folder are not in the layer's KML either
+        units = [unit for unit in units if unit.folder is not None]
+        seen = {}
+        self.keys = []
+        for unit in units:
+            key = unitKey(unit)
+            # copied counters share a GUID; pair them up by order of appearance
+            n = seen.get(key, 0)
+            seen[key] = n + 1
+            self.keys.append((key, n) if n else key)
+        self.names = [unit.name for unit in units]
+        self.folders = [unit.folder for unit in units]
+        self.lonLat = np.array([unit.pos for unit in units], dtype=float).reshape(-1, 2)
+
+def extractSave(path, layers=LAYERS):
+    """{layer: Extract} for every layer whose map is in the save."""
+    ttsState = jsonio.load(path)
+    index = SaveIndex(ttsState)
+    extracts = {}
+    for layer in layers:
+        converter = loadConverter(layer)
+        crs = geoReferencedMap(layer)
+        if crs.findMapTransform(index) is not None:
+            extracts[layer] = Extract(converter.extractUnits(ttsState, crs))
+    return extracts
+
+def diffLayer(old, new, minKm=0.05):
+    """{faction: {'moved', 'added', 'removed'}} between two Extracts of one layer."""
+    index = {key: i for i, key in enumerate(old.keys)}
+    pairs = [(index.pop(key), j) for j, key in enumerate(new.keys) if key in index]
+    matched = np.array(pairs, dtype=int).reshape(-1, 2)
+    a, b = old.lonLat[matched[:, 0]], new.lonLat[matched[:, 1]]
+    km = metres(b[:, 0] - a[:, 0], b[:, 1] - a[:, 1], (a[:, 1] + b[:, 1]) / 2) / 1000.0
+
+    report = {}
+    def entry(folder):
+        return report.setdefault(folder, {'moved': [], 'added': [], 'removed': []})
+    for (i, j), distance in zip(matched[km >= minKm], km[km >= minKm]):
+        entry(new.folders[j])['moved'].append({
+            'name': new.names[j], 'km': round(float(distance), 3),
+            'from': old.lonLat[i].tolist(), 'to': new.lonLat[j].tolist(),
+        })
+    matchedNew = set(matched[:, 1].tolist())
+    for j in range(len(new.keys)):
+        if j not in matchedNew:
+            entry(new.folders[j])['added'].append({'name': new.names[j], 'at': new.lonLat[j].tolist()})
+    for i in index.values():
+        entry(old.folders[i])['removed'].append({'name': old.names[i], 'at': old.lonLat[i].tolist()})
+    return report
+
+def diffSaves(oldPath, newPath, layers=LAYERS, minKm=0.05):
+    """{layer: diffLayer(...)} for the layers present in both saves."""
+    with ProcessPoolExecutor(2) as pool:
+        old, new = pool.map(extractSave, (oldPath, newPath), (layers, layers))
+    return {layer: diffLayer(old[layer], new[layer], minKm) for layer in layers if layer in old and layer in new}
+
+def arrow(lonFrom, latFrom, lonTo, latTo, headFraction=0.15):
+    """Shaft plus two barbs at the destination, as one coordinate string."""
+    dx, dy = lonTo - lonFrom, latTo - latFrom
+    barbs = []
+    for angle in (0.5, -0.5):
+        c, s = np.cos(angle), np.sin(angle)
+        barbs.append((lonTo - headFraction * (c * dx - s * dy), latTo - headFraction * (s * dx + c * dy)))
+    (lx, ly), (rx, ry) = barbs
+    return f"{lonFrom},{latFrom} {lonTo},{latTo} {lx},{ly} {lonTo},{latTo} {rx},{ry}"
+
+def createKmlDoc(layer, report):
+    """Movement arrows of one layer's diff, a folder per faction."""
+    from pykml.factory import KML_ElementMaker as KML
+
+    return KML.kml(
+        KML.Document(
+            KML.name(f'{layer} movement'),
+            *[KML.Style(KML.LineStyle(KML.color(colour), KML.width(2)), id=f'move{folder}')
+              for folder, colour in ARROW_COLOURS.items()],
+            *[KML.Folder(
+                KML.name(f'{folder}_{layer}'),
+                *[KML.Placemark(
+                    KML.name(move['name']),
+                    KML.description(f"{move['km']} km"),
+                    KML.styleUrl(f'#move{folder if folder in ARROW_COLOURS else "Undefined"}'),
+                    KML.LineString(KML.tessellate(1), KML.coordinates(arrow(*move['from'], *move['to']))),
+                ) for move in changes['moved']]
+            ) for folder, changes in report.items()]
+        )
+    )
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('old', help='save of the earlier turn')
+    parser.add_argument('new', help='save of the later turn')
+    parser.add_argument('--layers', nargs='+', default=list(LAYERS), choices=LAYERS)
+    parser.add_argument('--min-km', type=float, default=0.05, help='smaller displacements do not count as moves')
+    parser.add_argument('--json', help='write the full diff here')
+    parser.add_argument('--kml-dir', help='write <Layer>_moves.kml arrows here')
+    args = parser.parse_args(argv)
+
+    diffs = diffSaves(args.old, args.new, args.layers, args.min_km)
+    for layer, report in diffs.items():
+        if not report:
+            print(f"{layer}: no changes")
+        for folder, changes in report.items():
+            counts = ', '.join(f"{len(v)} {k}" for k, v in changes.items())
+            print(f"{layer} {folder}: {counts}")
+    if args.json:
+        jsonio.dump(diffs, args.json, indent=2)
+    if args.kml_dir:
+        from lxml import etree
+
+        os.makedirs(args.kml_dir, exist_ok=True)
+        for layer, report in diffs.items():
+            with open(os.path.join(args.kml_dir, f'{layer}_moves.kml'), 'wb') as out:
+                out.write(etree.tostring(createKmlDoc(layer, report), pretty_print=True, encoding="utf-8"))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""GeoJSON and compact binary output of a layer's units.
+
+Both are written from the UnitRecords extractUnits() already produced, and
+carry the same units as the KML folders (units without a folder are left
+out of both).
+
+The binary layout is meant to be read with typed arrays, without any XML
+or per-feature JSON parsing:
+
+    bytes 0-7    b'SOTNFEAT'
+    bytes 8-11   uint32 little-endian length of the header
+    header       UTF-8 JSON: layer, count, bbox, folders, strings and
+                 {name, type, offset} per column, padded to 8 bytes
+    columns      lon, lat  uint16, quantised over bbox: lon = west + q / 65535 * (east - west)
+                 folder    uint8, index into folders
+                 name, image, guid  uint32, index into strings
+"""
+import os
+import struct
+
+import numpy as np
+
+from sotn import jsonio
+from sotn.records import toArrays
+
+MAGIC = b'SOTNFEAT'
+QUANT = 65535
+
+def feature(unit):
+    return {
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': [unit.lon, unit.lat]},
+        'properties': {
+            'name': unit.name,
+            'tags': unit.tagList(),
+            'image': unit.image,
+            'guid': unit.guid,
+            'parent': unit.parent,
+        },
+    }
+
+def featureCollections(units):
+    """{folder: FeatureCollection} for every folder that has units."""
+    collections = {}
+    for unit in units:
+        if unit.folder is None:
+            continue
+        collection = collections.setdefault(unit.folder, {'type': 'FeatureCollection', 'features': []})
+        collection['features'].append(feature(unit))
+    return collections
+
+def writeGeoJson(directory, layer, units):
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for folder, collection in featureCollections(units).items():
+        path = os.path.join(directory, f'{layer}_{folder}.geojson')
+        jsonio.dump(collection, path)
+        paths.append(path)
+    return paths
+
+def _pad(data):
+    return data + b'\0' * (-len(data) % 8)
+
+def encodeBinary(layer, units):
+    units = [unit for unit in units if unit.folder is not None]
+    columns = toArrays(units)
+    lon, lat = columns['lon'], columns['lat']
+    if len(units):
+        bbox = [float(lon.min()), float(lat.min()), float(lon.max()), float(lat.max())]
+    else:
+        bbox = [0.0, 0.0, 0.0, 0.0]
+    west, south, east, north = bbox
+
+    def quantise(values, low, high):
+        span = (high - low) or 1.0
+        return np.rint((values - low) / span * QUANT).astype('<u2')
+
+    folders = sorted({unit.folder for unit in units})
+    strings = {}
+
+    def index(value):
+        return strings.setdefault(value or '', len(strings))
+
+    data = [
+        ('lon', quantise(lon, west, east)),
+        ('lat', quantise(lat, south, north)),
+        ('folder', np.fromiter((folders.index(u.folder) for u in units), dtype='u1', count=len(units))),
+        ('name', np.fromiter((index(u.name) for u in units), dtype='<u4', count=len(units))),
+        ('image', np.fromiter((index(u.image) for u in units), dtype='<u4', count=len(units))),
+        ('guid', np.fromiter((index(u.guid) for u in units), dtype='<u4', count=len(units))),
+    ]
+    types = {'<u2': 'uint16', 'u1': 'uint8', '|u1': 'uint8', '<u4': 'uint32'}
+    blobs = [_pad(array.tobytes()) for _, array in data]
+
+    # column offsets depend on the header length, which depends on the offsets' digits;
+    # iterate until the padded header length is stable
+    headerLength = 0
+    while True:
+        offset = len(MAGIC) + 4 + headerLength
+        layout = []
+        for (name, array), blob in zip(data, blobs):
+            layout.append({'name': name, 'type': types[array.dtype.str], 'offset': offset})
+            offset += len(blob)
+        header = _pad(jsonio.dumps({
+            'layer': layer, 'count': len(units), 'bbox': bbox, 'folders': folders,
+            'strings': list(strings), 'columns': layout,
+        }).encode('utf-8'))
+        if len(header) == headerLength:
+            break
+        headerLength = len(header)
+    return MAGIC + struct.pack('<I', headerLength) + header + b''.join(blobs)
+
+def decodeBinary(data):
+    """Inverse of encodeBinary: header dict plus {column: array} (lon/lat dequantised)."""
+    if data[:8] != MAGIC:
+        raise ValueError('not a SOTN feature file')
+    headerLength, = struct.unpack_from('<I', data, 8)
+    header = jsonio.loads(bytes(data[12:12 + headerLength]).rstrip(b'\0'))
+    dtypes = {'uint8': 'u1', 'uint16': '<u2', 'uint32': '<u4'}
+    count = header['count']
+    columns = {
+        c['name']: np.frombuffer(data, dtype=dtypes[c['type']], count=count, offset=c['offset'])
+        for c in header['columns']
+    }
+    west, south, east, north = header['bbox']
+    columns['lon'] = west + columns['lon'] / QUANT * (east - west)
+    columns['lat'] = south + columns['lat'] / QUANT * (north - south)
+    return header, columns
+
+def writeBinary(directory, layer, units):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{layer}.features.bin')
+    with open(path, 'wb') as out:
+        out.write(encodeBinary(layer, units))
+    return path
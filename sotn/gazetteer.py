@@ -0,0 +1,148 @@
+"""Where a unit is in human terms: '2.1 km NE of Lüneburg'.
+
+Towns are placed on the unit sphere and put in a KD-tree once; straight-line
+distance between unit vectors orders points exactly like great-circle
+distance, so the nearest town in the tree is the nearest on the globe. All
+units of a layer are answered in one batched query: each tree node is
+visited with every query that still needs it, and the work inside a node is
+vectorised over those queries.
+"""
+import numpy as np
+from pykml.factory import KML_ElementMaker as KML
+
+from sotn.validation import EARTH_RADIUS_M
+
+LEAF_SIZE = 16
+COMPASS = ('N', 'NE', 'E', 'SE', 'S', 'SW', 'W', 'NW')
+
+def unitVectors(lon, lat):
+    lon, lat = np.radians(lon), np.radians(lat)
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+def bearing(lonFrom, latFrom, lonTo, latTo):
+    """Initial great-circle bearing in degrees, 0 = north, clockwise."""
+    lonFrom, latFrom, lonTo, latTo = map(np.radians, (lonFrom, latFrom, lonTo, latTo))
+    dLon = lonTo - lonFrom
+    y = np.sin(dLon) * np.cos(latTo)
+    x = np.cos(latFrom) * np.sin(latTo) - np.sin(latFrom) * np.cos(latTo) * np.cos(dLon)
+    return np.degrees(np.arctan2(y, x)) % 360.0
+
+def compassPoint(degrees):
+    return COMPASS[int((degrees + 22.5) // 45) % 8]
+
+class KdTree:
+    """Static KD-tree over (n, k) points for batched nearest-neighbour queries."""
+
+    def __init__(self, points, leafSize=LEAF_SIZE):
+        self.points = np.asarray(points, dtype=float)
+        self.order = np.arange(len(self.points))
+        # per node: split axis (-1 for a leaf), split value, children, and the leaf's slice of order
+        self.axis, self.split, self.children, self.slices = [], [], [], []
+        stack = [(self.newNode(), 0, len(self.points))]
+        while stack:
+            node, start, end = stack.pop()
+            if end - start <= leafSize:
+                self.slices[node] = (start, end)
+                continue
+            members = self.points[self.order[start:end]]
+            axis = int(np.argmax(members.max(axis=0) - members.min(axis=0)))
+            middle = (end - start) // 2
+            part = np.argpartition(members[:, axis], middle)
+            self.order[start:end] = self.order[start:end][part]
+            self.axis[node], self.split[node] = axis, float(members[part[middle], axis])
+            left, right = self.newNode(), self.newNode()
+            self.children[node] = (left, right)
+            stack += [(left, start, start + middle), (right, start + middle, end)]
+
+    def newNode(self):
+        self.axis.append(-1)
+        self.split.append(0.0)
+        self.children.append(None)
+        self.slices.append(None)
+        return len(self.axis) - 1
+
+    def nearest(self, queries):
+        """(index of the nearest point, distance) for every row of queries."""
+        queries = np.asarray(queries, dtype=float)
+        best = np.full(len(queries), np.inf)
+        found = np.full(len(queries), -1)
+        # (node, query indices, distance of those queries to the node's side of the split)
+        stack = [(0, np.arange(len(queries)), np.zeros(len(queries)))]
+        while stack:
+            node, members, bound = stack.pop()
+            members = members[bound < best[members]]
+            if not len(members):
+                continue
+            if self.axis[node] < 0:
+                start, end = self.slices[node]
+                candidates = self.order[start:end]
+                d = np.linalg.norm(queries[members, None, :] - self.points[None, candidates, :], axis=2)
+                k = np.argmin(d, axis=1)
+                closest = d[np.arange(len(members)), k]
+                better = closest < best[members]
+                best[members[better]] = closest[better]
+                found[members[better]] = candidates[k[better]]
+                continue
+            offset = queries[members, self.axis[node]] - self.split[node]
+            left, right = self.children[node]
+            goLeft = offset < 0
+            # the far sides first, so they are popped last, when best has tightened
+            stack += [
+                (right, members[goLeft], -offset[goLeft]),
+                (left, members[~goLeft], offset[~goLeft]),
+                (left, members[goLeft], np.zeros(goLeft.sum())),
+                (right, members[~goLeft], np.zeros((~goLeft).sum())),
+            ]
+        return found, best
+
+class Gazetteer:
+    def __init__(self, names, lon, lat):
+        self.names = list(names)
+        self.lon = np.asarray(lon, dtype=float)
+        self.lat = np.asarray(lat, dtype=float)
+        self.tree = KdTree(unitVectors(self.lon, self.lat))
+
+    @classmethod
+    def fromTownsLua(cls, path):
+        """Gazetteer of a towns.lua file, named by display_name where there is one."""
+        from lupa.lua54 import LuaRuntime
+
+        lua = LuaRuntime(unpack_returned_tuples=True)
+        lua.globals().loadfile(path)()
+        towns = [(town['display_name'] or name, town['longitude'], town['latitude'])
+                 for name, town in lua.globals().towns.items()]
+        return cls(*zip(*towns))
+
+    def nearest(self, lon, lat):
+        """(town indices, distances in metres, bearings from the towns) for arrays of positions."""
+        lon, lat = np.asarray(lon, dtype=float), np.asarray(lat, dtype=float)
+        found, chord = self.tree.nearest(unitVectors(lon, lat))
+        metres = 2.0 * EARTH_RADIUS_M * np.arcsin(np.clip(chord / 2.0, 0.0, 1.0))
+        return found, metres, bearing(self.lon[found], self.lat[found], lon, lat)
+
+    def locate(self, units):
+        """A Location for each unit, from one batched query."""
+        if not units:
+            return []
+        found, metres, degrees = self.nearest([u.lon for u in units], [u.lat for u in units])
+        return [Location(self.names[i], m, b) for i, m, b in zip(found.tolist(), metres.tolist(), degrees.tolist())]
+
+class Location:
+    __slots__ = ('town', 'metres', 'bearing')
+
+    def __init__(self, town, metres, bearing):
+        self.town = town
+        self.metres = metres
+        self.bearing = bearing
+
+    def __str__(self):
+        if self.metres < 500:
+            return f'at {self.town}'
+        return f'{self.metres / 1000:.1f} km {compassPoint(self.bearing)} of {self.town}'
+
+    def extendedData(self):
+        return KML.ExtendedData(
+            KML.Data(KML.value(self.town), name='nearestTown'),
+            KML.Data(KML.value(f'{self.metres / 1000:.2f}'), name='distanceKm'),
+            KML.Data(KML.value(f'{self.bearing:.0f}'), name='bearing'),
+        )
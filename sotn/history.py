@@ -0,0 +1,141 @@
+"""Join units across an ordered series of saves and write time-enabled KML.
+
+Each save is one turn. Saves are read one at a time and only the per-unit
+tracks are kept, so long campaigns never need more than one save in memory:
+
+    python -m sotn.history turn001.json turn002.json ... --out-dir history
+"""
+import argparse
+import os
+from array import array
+from datetime import datetime, timedelta
+
+from sotn import jsonio
+from sotn.layers import LAYERS, geoReferencedMap, loadConverter
+from sotn.saveindex import SaveIndex
+
+FOLDERS = ('NATO', 'Pact', 'Undefined')
+
+def unitKey(unit):
+    """Join key for a unit: its GUID, or nickname plus tags when it has none.
+
+    Tags are keyed by name, not by the tag bitmask, whose bit order depends
+    on the order each process first saw them.
+    """
+    return unit.guid or (unit.name, tuple(sorted(unit.tagList())))
+
+
+class Track:
+    __slots__ = ('name', 'image', 'faction', 'turns', 'coords')
+
+    def __init__(self, unit):
+        self.name = unit.name.replace(' ', '')
+        self.image = unit.image
+        self.faction = unit.folder if unit.folder in FOLDERS else 'Undefined'
+        self.turns = array('i')
+        self.coords = array('d')
+
+    def positions(self):
+        return zip(self.turns, self.coords[0::2], self.coords[1::2])
+
+class History:
+    def __init__(self, layers=LAYERS):
+        self.layers = {layer: (loadConverter(layer), geoReferencedMap(layer)) for layer in layers}
+        self.tracks = {layer: {} for layer in layers}
+        self.turns = 0
+
+    def addSave(self, ttsState):
+        """Append one turn; nothing from ttsState is kept afterwards."""
+        turn = self.turns
+        index = SaveIndex(ttsState)
+        for layer, (converter, crs) in self.layers.items():
+            if crs.findMapTransform(index) is None:
+                print(f"Turn {turn}: {layer} not found, skipped")
+                continue
+            tracks = self.tracks[layer]
+            seen = {}
+            for unit in converter.extractUnits(ttsState, crs):
+                # units in no folder are left out of the layer's KML, so of its history too
+                if unit.folder is None:
+                    continue
+                key = unitKey(unit)
+                # the same key twice in one save (copied counters) gets its own track
+                n = seen.get(key, 0)
+                seen[key] = n + 1
+                if n:
+                    key = (key, n)
+                track = tracks.get(key)
+                if track is None:
+                    track = tracks[key] = Track(unit)
+                track.turns.append(turn)
+                track.coords.extend(unit.pos)
+        self.turns += 1
+
+    def createKmlDoc(self, layer, times, timespan=False):
+        """KML for one layer; times[i] is the timestamp of turn i (len turns+1)."""
+        from pykml.factory import GX_ElementMaker as GX
+        from pykml.factory import KML_ElementMaker as KML
+
+        styles = {}
+        folders = {folder: [] for folder in FOLDERS}
+        for track in self.tracks[layer].values():
+            if track.image not in styles:
+                styles[track.image] = f'icon{len(styles)}'
+            if timespan:
+                placemarks = [
+                    KML.Placemark(
+                        KML.name(track.name),
+                        KML.TimeSpan(KML.begin(times[turn]), KML.end(times[turn + 1])),
+                        KML.styleUrl(f'#{styles[track.image]}'),
+                        KML.Point(KML.coordinates(f"{lon},{lat}")),
+                    )
+                    for turn, lon, lat in track.positions()
+                ]
+                folders[track.faction].append(KML.Folder(KML.name(track.name), *placemarks))
+            else:
+                whens = [KML.when(times[turn]) for turn in track.turns]
+                coords = [GX.coord(f"{lon} {lat} 0") for _, lon, lat in track.positions()]
+                folders[track.faction].append(KML.Placemark(
+                    KML.name(track.name), KML.styleUrl(f'#{styles[track.image]}'), GX.Track(*whens, *coords)
+                ))
+
+        return KML.kml(
+            KML.Document(
+                KML.name(f'{layer} history'),
+                *[KML.Style(KML.IconStyle(KML.scale(1.7), KML.Icon(KML.href(image))), id=styleId)
+                  for image, styleId in styles.items()],
+                *[KML.Folder(KML.name(f'{folder}_{layer}'), *items) for folder, items in folders.items()]
+            )
+        )
+
+def turnTimes(start, hours, count):
+    step = timedelta(hours=hours)
+    return [(start + i * step).strftime('%Y-%m-%dT%H:%M:%SZ') for i in range(count + 1)]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('saves', nargs='+', help='save files or zip bundles of them, oldest turn first')
+    parser.add_argument('--out-dir', default='.')
+    parser.add_argument('--start', default='1989-01-01T00:00:00', help='timestamp of the first turn')
+    parser.add_argument('--hours', type=float, default=24.0, help='game time between turns')
+    parser.add_argument('--timespan', action='store_true', help='TimeSpan placemarks instead of gx:Track')
+    parser.add_argument('--layers', nargs='+', default=list(LAYERS), choices=LAYERS)
+    args = parser.parse_args(argv)
+
+    history = History(args.layers)
+    # archives are read member by member, one parsed save in memory at a time
+    for path in jsonio.expandSaves(args.saves):
+        history.addSave(jsonio.load(path))
+
+    from lxml import etree
+
+    times = turnTimes(datetime.fromisoformat(args.start), args.hours, history.turns)
+    os.makedirs(args.out_dir, exist_ok=True)
+    for layer in args.layers:
+        doc = history.createKmlDoc(layer, times, args.timespan)
+        with open(os.path.join(args.out_dir, f'{layer}_history.kml'), 'wb') as out:
+            out.write(etree.tostring(doc, pretty_print=True, encoding="utf-8"))
+        print(f"{layer}: {len(history.tracks[layer])} tracks over {history.turns} turns")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""JSON loading and dumping through the fastest parser that is installed.
+
+orjson is preferred, then pysimdjson, then the standard library. Files are
+memory-mapped and handed to the parser as bytes, so multi-megabyte saves
+are never decoded to a str first. Set SOTN_JSON=json|orjson|simdjson to
+force a backend.
+
+Saves may also be gzip or zstd compressed, or members of a zip archive
+named as 'bundle.zip!turn042.json' (or just 'bundle.zip' when it holds one
+save). They are recognised by their leading bytes and decompressed as a
+stream into memory, never to a temporary file. zstd needs the zstandard
+package (pip install zstandard). Compare the backends on real files with:
+
+    python -m sotn.jsonio TS_Save_48.json counters.json
+"""
+import contextlib
+import gzip
+import importlib
+import json
+import mmap
+import os
+import sys
+import time
+import zipfile
+
+BACKENDS = ('orjson', 'simdjson', 'json')
+BOM = b'\xef\xbb\xbf'
+MAGIC = {b'\x1f\x8b': 'gzip', b'\x28\xb5\x2f\xfd': 'zstd', b'PK\x03\x04': 'zip'}
+MEMBER_SEPARATOR = '!'
+CHUNK = 1 << 20
+
+def _loader(name):
+    if name == 'json':
+        return json.loads
+    module = importlib.import_module(name)
+    return module.loads
+
+def _select():
+    names = [os.environ['SOTN_JSON']] if os.environ.get('SOTN_JSON') else BACKENDS
+    for name in names:
+        try:
+            return name, _loader(name)
+        except ImportError:
+            continue
+    return 'json', json.loads
+
+BACKEND, _loads = _select()
+
+def loads(data):
+    """Parse JSON from str or bytes."""
+    if isinstance(data, (bytes, bytearray, memoryview)) and bytes(data[:3]) == BOM:
+        data = data[3:]
+    if BACKEND == 'json' and isinstance(data, memoryview):
+        data = bytes(data)
+    return _loads(data)
+
+def splitMember(path):
+    """(archive, member) for 'bundle.zip!turn042.json', else (path, None)."""
+    archive, separator, member = path.rpartition(MEMBER_SEPARATOR)
+    if separator and os.path.isfile(archive):
+        return archive, member
+    return path, None
+
+def compression(f):
+    """'gzip', 'zstd', 'zip' or None, from the leading bytes of a binary file."""
+    head = f.read(4)
+    f.seek(0)
+    return next((kind for magic, kind in MAGIC.items() if head.startswith(magic)), None)
+
+def jsonMembers(archive):
+    return [info.filename for info in archive.infolist()
+            if not info.is_dir() and info.filename.lower().endswith('.json')]
+
+@contextlib.contextmanager
+def openSave(path):
+    """Binary stream of a file's JSON, decompressing gzip, zstd and zip members on the fly."""
+    archivePath, member = splitMember(path)
+    with open(archivePath, 'rb') as f:
+        kind = compression(f)
+        if kind == 'zip':
+            with zipfile.ZipFile(f) as archive:
+                if member is None:
+                    members = jsonMembers(archive)
+                    if len(members) != 1:
+                        raise ValueError(f"{path} holds {len(members)} JSON files; "
+                                         f"name one as {path}{MEMBER_SEPARATOR}<member>")
+                    member = members[0]
+                with archive.open(member) as stream:
+                    yield stream
+        elif kind == 'gzip':
+            with gzip.GzipFile(fileobj=f) as stream:
+                yield stream
+        elif kind == 'zstd':
+            import zstandard
+            with zstandard.ZstdDecompressor().stream_reader(f) as stream:
+                yield stream
+        else:
+            yield f
+
+def expandSaves(paths):
+    """paths with each multi-save zip archive replaced by its JSON members, in archive order."""
+    expanded = []
+    for path in paths:
+        archivePath, member = splitMember(path)
+        if member is None and os.path.isfile(path):
+            with open(path, 'rb') as f:
+                if compression(f) == 'zip':
+                    with zipfile.ZipFile(f) as archive:
+                        expanded += [f'{path}{MEMBER_SEPARATOR}{name}' for name in jsonMembers(archive)]
+                    continue
+        expanded.append(path)
+    return expanded
+
+def load(path):
+    """Parse a JSON file: memory-mapped when plain, decompressed in memory otherwise."""
+    archivePath, member = splitMember(path)
+    with open(archivePath, 'rb') as f:
+        if member is None and compression(f) is None:
+            if os.fstat(f.fileno()).st_size == 0:
+                return loads(b'')
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if BACKEND == 'orjson':
+                    with memoryview(mapped) as view:
+                        return loads(view)
+                return loads(mapped[:])
+    with openSave(path) as stream:
+        data = bytearray()
+        for chunk in iter(lambda: stream.read(CHUNK), b''):
+            data += chunk
+    return loads(data)
+
+def dumps(obj, indent=None, fast=False):
+    """Serialise to str with the standard library, so output is the same whichever backend is installed.
+
+    fast=True allows orjson for output that is only ever parsed again
+    (caches, HTTP replies): it is compact and keeps non-ASCII characters
+    unescaped, so its layout differs from json.dumps.
+    """
+    if fast and BACKEND == 'orjson' and indent in (None, 2):
+        import orjson
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0).decode('utf-8')
+    return json.dumps(obj, indent=indent)
+
+def dump(obj, path, indent=None, fast=False):
+    with open(path, 'w', encoding='utf-8') as out:
+        out.write(dumps(obj, indent, fast))
+
+def _time(parse, data, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parse(data)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main(argv=None):
+    paths = sys.argv[1:] if argv is None else argv
+    available = []
+    for name in BACKENDS:
+        try:
+            available.append((name, _loader(name)))
+        except ImportError:
+            print(f"{name}: not installed")
+    for path in paths:
+        with open(path, 'rb') as f:
+            data = f.read().removeprefix(BOM)
+        print(f"{path} ({len(data) / 1e6:.1f} MB)")
+        stdlib = _time(json.loads, data)
+        for name, parse in available:
+            elapsed = _time(parse, data)
+            print(f"  {name:9s} {elapsed * 1000:8.1f} ms  {stdlib / elapsed:5.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Access to the per-layer AnalyzeTTS-<layer> folders and their converters.
+
+Nothing heavy is imported until a converter is first needed. convert() is
+the entry point for embedding the conversion:
+
+    from sotn.api import convert
+    kml = convert('TS_Save_48.json')        # {'TacMap': b'<?xml ...', ...}
+"""
+import copy
+import importlib.util
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAYERS = ('TacMap', 'StratMap', 'OpMap')
+
+_converters = {}
+_maps = {}
+
+def layerDir(layer, project='TTS2KML'):
+    return os.path.join(ROOT, f'AnalyzeTTS-{layer}', project)
+
+def loadConverter(layer):
+    """Import (once) and return the layer's TTS2KML.py as a module."""
+    if layer not in _converters:
+        path = os.path.join(layerDir(layer), 'TTS2KML.py')
+        spec = importlib.util.spec_from_file_location(f'TTS2KML_{layer}', path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _converters[layer] = module
+    return _converters[layer]
+
+def geoReferencedMap(layer, transformPath=None):
+    """A GeoReferencedMap for the layer, with no map located yet.
+
+    Maps are cached by their tts2lola.json (path and modification time), so
+    repeated conversions parse each file once; every call returns its own
+    copy, which findMapTransform can point at a different save.
+    """
+    converter = loadConverter(layer)
+    path = os.path.abspath(transformPath or converter.TRANSFORM_FILE)
+    key = (layer, path, os.stat(path).st_mtime_ns)
+    if key not in _maps:
+        _maps[key] = converter.GeoReferencedMap(transformPath=path)
+    crs = copy.copy(_maps[key])
+    crs.mapTransform = None
+    return crs
+
+def renderLayer(layer, ttsState, missionName='Sample', index=None):
+    """Run one layer's conversion on a parsed save and return the KML bytes.
+
+    Pass the save's SaveIndex when rendering several layers of one save.
+    """
+    from lxml import etree
+    from sotn.lines import extractLines
+
+    converter = loadConverter(layer)
+    crs = geoReferencedMap(layer)
+    if crs.findMapTransform(index or ttsState) is None:
+        return None
+    doc = converter.createKmlDoc(missionName, converter.extractUnits(ttsState, crs))
+    converter.exportLines(doc, extractLines(ttsState, crs))
+    return etree.tostring(doc, pretty_print=True, encoding="utf-8")
+
+def convert(save, layers=LAYERS, missionName='Sample'):
+    """{layer: KML bytes} for the layers whose map is in save (a path or a parsed save)."""
+    from sotn import jsonio
+    from sotn.saveindex import SaveIndex
+
+    ttsState = jsonio.load(save) if isinstance(save, (str, os.PathLike)) else save
+    index = SaveIndex(ttsState)
+    rendered = {layer: renderLayer(layer, ttsState, missionName, index) for layer in layers}
+    return {layer: body for layer, body in rendered.items() if body is not None}
@@ -0,0 +1,91 @@
+"""Drawn vector lines of a save, on a layer's map, as simplified lon/lat lines.
+
+All points of all lines go through the layer transform in one array call;
+each line is then simplified with Douglas-Peucker in local metres, which
+turns freehand strokes of thousands of points into a few dozen.
+"""
+import numpy as np
+from pykml.factory import KML_ElementMaker as KML
+
+from sotn.bounds import insideBounds, relativeOffsets
+from sotn.validation import EARTH_RADIUS_M
+
+DEFAULT_TOLERANCE = 50.0
+
+class Line:
+    """A route for exportKml: name, points as (lon, lat), and its style."""
+    __slots__ = ('name', 'points', 'color', 'width')
+
+    def __init__(self, name, points, color, width):
+        self.name = name
+        self.points = points
+        self.color = color
+        self.width = width
+
+    @property
+    def styleId(self):
+        return f'line{self.color}w{self.width}'
+
+def kmlColor(color):
+    """TTS {r, g, b[, a]} in 0..1 to KML aabbggrr."""
+    channels = [color.get(k, 1.0) for k in ('a', 'b', 'g', 'r')]
+    return ''.join(f'{int(round(min(max(c, 0.0), 1.0) * 255)):02x}' for c in channels)
+
+def simplify(points, tolerance):
+    """Indices kept by Douglas-Peucker on an (n, 2) array in metres.
+
+    Each split measures all points of its span at once; only the spans
+    still to split are visited, so the work is vectorised per span.
+    """
+    n = len(points)
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, n - 1]] = True
+    spans = [(0, n - 1)]
+    while spans:
+        i, j = spans.pop()
+        if j - i < 2:
+            continue
+        a, b = points[i], points[j]
+        inner = points[i + 1:j] - a
+        d = b - a
+        length2 = d @ d
+        t = np.clip(inner @ d / length2, 0.0, 1.0) if length2 else np.zeros(len(inner))
+        distance = np.hypot(*(inner - t[:, None] * d).T)
+        k = int(np.argmax(distance))
+        if distance[k] > tolerance:
+            m = i + 1 + k
+            keep[m] = True
+            spans += [(i, m), (m, j)]
+    return np.flatnonzero(keep)
+
+def extractLines(ttsState, crs, tolerance=DEFAULT_TOLERANCE):
+    """Lines with most of their points inside the layer's bounds, simplified to tolerance metres."""
+    vectorLines = [line for line in ttsState.get('VectorLines') or [] if len(line.get('points3') or ()) >= 2]
+    if not vectorLines or crs.mapTransform is None:
+        return []
+    world = np.array([(p['x'], p['z']) for line in vectorLines for p in line['points3']], dtype=float)
+    x, y = relativeOffsets(crs.mapTransform, world[:, 0], world[:, 1])
+    inside = insideBounds(crs.data['bounds'], x, y)
+    lon, lat = crs.relativeToLoLa(x, y)
+    lon, lat = np.asarray(lon, dtype=float), np.asarray(lat, dtype=float)
+
+    lines = []
+    ends = np.cumsum([len(line['points3']) for line in vectorLines])
+    for number, (line, end) in enumerate(zip(vectorLines, ends), 1):
+        start = end - len(line['points3'])
+        if inside[start:end].mean() <= 0.5:
+            continue
+        lo, la = lon[start:end], lat[start:end]
+        k = np.pi / 180.0 * EARTH_RADIUS_M
+        metres = np.column_stack([lo * k * np.cos(np.radians(la.mean())), la * k])
+        kept = simplify(metres, tolerance) if tolerance > 0 else np.arange(end - start)
+        width = max(1, int(round(line.get('thickness', 0.1) * 20)))
+        lines.append(Line(f'Line {number}', list(zip(lo[kept].tolist(), la[kept].tolist())),
+                          kmlColor(line.get('color') or {}), width))
+    return lines
+
+def lineStyles(lines):
+    """One LineStyle per distinct colour and width."""
+    styles = {line.styleId: line for line in lines}
+    return [KML.Style(KML.LineStyle(KML.color(line.color), KML.width(line.width)), id=styleId)
+            for styleId, line in styles.items()]
@@ -0,0 +1,106 @@
+"""Hash-stamped outputs and the manifest.json that lists them.
+
+With --publish DIR a conversion writes each of its outputs into DIR as
+<name>.<hash><ext>, hash being the start of the SHA-256 of the content, and
+records it in DIR/manifest.json with its size, the layer's unit counts and
+the hash of the save it came from:
+
+    {"version": 1, "layers": {"TacMap": {
+        "save": {"name": "TS_Save_48.json", "sha1": "..."},
+        "units": {"NATO": 812, "Pact": 790, "Undefined": 3, "total": 1605},
+        "files": {"TacMap.kml": {"path": "TacMap.3f9c0a1e5b27.kml", "sha256": "...", "bytes": 1048576}},
+        "superseded": [...]}}}
+
+A file whose content did not change keeps its name, so a client fetches
+manifest.json (which must not be cached) and then only the paths it does
+not have yet, and every stamped file can be served as immutable. The files
+of a layer's previous publication stay on disk, listed as superseded, for
+clients still holding the old manifest; older ones are deleted.
+"""
+import hashlib
+import os
+from collections import Counter
+
+from sotn import jsonio
+from sotn.snapshots import fileHash
+
+MANIFEST = 'manifest.json'
+VERSION = 1
+STAMP_LENGTH = 12
+
+def contentHash(data):
+    return hashlib.sha256(data).hexdigest()
+
+def stampedName(name, digest):
+    """'TacMap.kml' -> 'TacMap.3f9c0a1e5b27.kml'."""
+    stem, ext = os.path.splitext(name)
+    return f'{stem}.{digest[:STAMP_LENGTH]}{ext}'
+
+def unitCounts(units):
+    """Units per KML folder; units in no folder are not in the outputs, so not counted."""
+    counts = Counter(unit.folder for unit in units if unit.folder is not None)
+    return {**dict(sorted(counts.items())), 'total': sum(counts.values())}
+
+class Manifest:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.layers = {}
+        path = self._path(MANIFEST)
+        if os.path.exists(path):
+            self.layers = jsonio.load(path).get('layers', {})
+        # layer -> its entry in the manifest as it was read
+        self.replaced = {}
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def startLayer(self, layer, savePath, units):
+        """Begin a new publication of layer; its files are then listed with add()."""
+        self.replaced.setdefault(layer, self.layers.get(layer, {}))
+        self.layers[layer] = {
+            'save': {'name': os.path.basename(savePath), 'sha1': fileHash(savePath)},
+            'units': unitCounts(units),
+            'files': {},
+        }
+
+    def add(self, layer, name, data):
+        """Write data under its stamped name (unless already there) and list it; returns the path."""
+        digest = contentHash(data)
+        stamped = stampedName(name, digest)
+        path = self._path(stamped)
+        if not os.path.exists(path):
+            tmp = path + '.tmp'
+            with open(tmp, 'wb') as out:
+                out.write(data)
+            os.replace(tmp, path)
+        self.layers[layer]['files'][name] = {'path': stamped, 'sha256': digest, 'bytes': len(data)}
+        return path
+
+    def addFile(self, layer, path):
+        """add() the content of a file written elsewhere, under its base name."""
+        with open(path, 'rb') as f:
+            return self.add(layer, os.path.basename(path), f.read())
+
+    def save(self):
+        """Write manifest.json atomically and delete files two publications old."""
+        stale = set()
+        for layer, old in self.replaced.items():
+            entry = self.layers[layer]
+            entry['files'] = dict(sorted(entry['files'].items()))
+            current = {f['path'] for f in entry['files'].values()}
+            previous = {f['path'] for f in old.get('files', {}).values()}
+            if previous == current:
+                superseded = set(old.get('superseded', ())) - current
+            else:
+                superseded = previous - current
+                stale |= set(old.get('superseded', ())) - current - superseded
+            entry['superseded'] = sorted(superseded)
+        tmp = self._path(MANIFEST + '.tmp')
+        jsonio.dump({'version': VERSION, 'layers': self.layers}, tmp, indent=4)
+        os.replace(tmp, self._path(MANIFEST))
+        # only after the manifest that no longer mentions them is in place
+        for name in sorted(stale):
+            if os.path.exists(self._path(name)):
+                os.remove(self._path(name))
+        self.replaced = {}
@@ -0,0 +1,89 @@
+"""Content-hash memo of generated TTS object subtrees, persisted between runs.
+
+Every subtree is keyed by the digest of the source data it was built from,
+the builder, its other arguments and a salt (e.g. the templates text). A hit
+hands back the object generated last time, GUIDs included; a miss builds it
+again but keeps the GUID previously used at the same place in the tree. Only
+entries reached during a run are written back, so stale ones drop out.
+"""
+import functools
+import hashlib
+import json
+import os
+
+from sotn import jsonio
+
+class BuildCache:
+    def __init__(self, path, salt=''):
+        self.path = path
+        self.salt = salt
+        stored = jsonio.load(path) if os.path.exists(path) else {}
+        self.old = stored.get('entries', {})
+        self.guids = {e['path']: e['object'].get('GUID') for e in self.old.values() if e['object']}
+        self.guids.update(stored.get('pinned', {}))
+        self.pinned = {}
+        self.entries = {}
+        self.digests = {}
+        self.stack = []
+        self.hits = self.misses = 0
+
+    def digest(self, data):
+        """Digest of a JSON value; dicts are hashed bottom-up, once per run."""
+        if not isinstance(data, dict):
+            return hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()
+        cached = self.digests.get(id(data))
+        if cached is not None:
+            return cached[1]
+        h = hashlib.sha1(b'{')
+        for k in sorted(data):
+            h.update(json.dumps(k).encode())
+            h.update(self.digest(data[k]).encode())
+        value = h.hexdigest()
+        self.digests[id(data)] = (data, value)
+        return value
+
+    def memoize(self, fn):
+        """Decorate a builder called as fn(data, name, *args) with JSON-able args."""
+        @functools.wraps(fn)
+        def wrapper(data, name, *args):
+            return self.build([fn.__name__, name, *args], data, lambda: fn(data, name, *args))
+        return wrapper
+
+    def build(self, label, data, factory):
+        path = json.dumps(label)
+        h = hashlib.sha1(json.dumps([self.salt, path]).encode())
+        h.update(self.digest(data).encode())
+        key = h.hexdigest()
+        if self.stack:
+            self.stack[-1].append(key)
+        entry = self.old.get(key) or self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.keep(key, entry)
+            return entry['object']
+        self.misses += 1
+        self.stack.append([])
+        try:
+            obj = factory()
+        finally:
+            children = self.stack.pop()
+        if obj is not None and self.guids.get(path):
+            obj['GUID'] = self.guids[path]
+        self.entries[key] = {'path': path, 'children': children, 'object': obj}
+        return obj
+
+    def keep(self, key, entry):
+        self.entries[key] = entry
+        for child in entry['children']:
+            if child not in self.entries and child in self.old:
+                self.keep(child, self.old[child])
+
+    def stableGuid(self, path, guid):
+        """GUID for an object built outside the memo, kept across runs."""
+        self.pinned[path] = self.guids.get(path, guid)
+        return self.pinned[path]
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        jsonio.dump({'pinned': self.pinned, 'entries': self.entries}, tmp, fast=True)
+        os.replace(tmp, self.path)
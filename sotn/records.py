@@ -0,0 +1,80 @@
+"""Compact unit records produced by each layer's extractUnits().
+
+A record keeps only what the outputs need, so the parsed save can be
+dropped as soon as extraction finishes. Tags are folded into a bitmask over
+a process-wide tag table and image URLs are interned, so thousands of
+counters sharing a handful of images and tags cost one string each.
+"""
+import sys
+
+_tagBits = {}
+_tagNames = []
+
+def tagBit(tag):
+    bit = _tagBits.get(tag)
+    if bit is None:
+        bit = _tagBits[tag] = 1 << len(_tagNames)
+        _tagNames.append(tag)
+    return bit
+
+def tagMask(tags):
+    mask = 0
+    for tag in tags or ():
+        if isinstance(tag, str):
+            mask |= tagBit(tag)
+    return mask
+
+def tagNames(mask):
+    return [tag for i, tag in enumerate(_tagNames) if mask >> i & 1]
+
+class UnitRecord:
+    __slots__ = ('guid', 'name', 'tags', 'image', 'lon', 'lat', 'x', 'z', 'parent', 'folder')
+
+    def __init__(self, guid, name, tags, image, lon, lat, x, z, parent=None, folder=None):
+        self.guid = guid
+        self.name = name
+        self.tags = tags
+        self.image = image
+        self.lon = lon
+        self.lat = lat
+        self.x = x
+        self.z = z
+        self.parent = parent
+        self.folder = folder
+
+    @classmethod
+    def fromObject(cls, obj, pos, transform=None, parent=None, folder=None):
+        """Record for a TTS object placed at pos; contained items pass the parent's transform."""
+        transform = transform or obj.get('Transform') or {}
+        return cls(
+            obj.get('GUID') or '',
+            obj.get('Nickname') or '',
+            tagMask(obj.get('Tags')),
+            sys.intern((obj.get('CustomImage') or {}).get('ImageURL') or ''),
+            pos[0], pos[1],
+            transform.get('posX', float('nan')), transform.get('posZ', float('nan')),
+            parent,
+            folder,
+        )
+
+    @property
+    def pos(self):
+        return (self.lon, self.lat)
+
+    def hasTag(self, tag):
+        return bool(self.tags & _tagBits.get(tag, 0))
+
+    def tagList(self):
+        return tagNames(self.tags)
+
+def toArrays(units):
+    """lon, lat, x and z of a list of records as float arrays."""
+    import numpy as np
+
+    count = len(units)
+    return {
+        'lon': np.fromiter((u.lon for u in units), dtype=float, count=count),
+        'lat': np.fromiter((u.lat for u in units), dtype=float, count=count),
+        'x': np.fromiter((u.x for u in units), dtype=float, count=count),
+        'z': np.fromiter((u.z for u in units), dtype=float, count=count),
+    }
@@ -0,0 +1,69 @@
+"""Lookup tables over a parsed save, built in one walk of ObjectStates.
+
+Objects are indexed by GUID, Nickname, Name and Tag, including everything
+inside containers, and each contained object keeps a link to its
+container. Nicknames are keyed without line breaks and surrounding blanks
+(city markers are often saved as 'Celle\\n'). Lists keep save order.
+
+The index references every object, so it keeps the save alive: build it
+once where a save is parsed and pass it on instead of the raw dict.
+"""
+
+class SaveIndex:
+    def __init__(self, ttsState):
+        self.objects = ttsState.get('ObjectStates') or []
+        self.byGuid = {}
+        self.byNickname = {}
+        self.byName = {}
+        self.byTag = {}
+        self.parents = {}
+        stack = [(obj, None) for obj in reversed(self.objects)]
+        while stack:
+            obj, parent = stack.pop()
+            if not isinstance(obj, dict):
+                continue
+            if parent is not None:
+                self.parents[id(obj)] = parent
+            if obj.get('GUID'):
+                self.byGuid.setdefault(obj['GUID'], obj)
+            nickname = obj.get('Nickname')
+            if isinstance(nickname, str) and nickname.strip():
+                self.byNickname.setdefault(nicknameKey(nickname), []).append(obj)
+            if obj.get('Name'):
+                self.byName.setdefault(obj['Name'], []).append(obj)
+            for tag in obj.get('Tags') or ():
+                self.byTag.setdefault(tag, []).append(obj)
+            stack.extend((child, obj) for child in reversed(obj.get('ContainedObjects') or ()))
+
+    @classmethod
+    def of(cls, save):
+        """save itself if it is already an index, else a new index of the parsed save."""
+        return save if isinstance(save, cls) else cls(save)
+
+    def parent(self, obj):
+        return self.parents.get(id(obj))
+
+    def get(self, guid):
+        return self.byGuid.get(guid)
+
+    def withNickname(self, nickname, topLevel=False):
+        objects = self.byNickname.get(nicknameKey(nickname), [])
+        return [o for o in objects if id(o) not in self.parents] if topLevel else objects
+
+    def withName(self, name, topLevel=False):
+        objects = self.byName.get(name, [])
+        return [o for o in objects if id(o) not in self.parents] if topLevel else objects
+
+    def withTag(self, tag):
+        return self.byTag.get(tag, [])
+
+    def first(self, nicknames, topLevel=True):
+        """First object with a Transform whose Nickname is in nicknames, in their order of preference."""
+        for nickname in nicknames:
+            for obj in self.withNickname(nickname, topLevel):
+                if obj.get('Transform'):
+                    return obj
+        return None
+
+def nicknameKey(nickname):
+    return nickname.replace('\n', '').strip()
@@ -0,0 +1,175 @@
+"""Serve the three layers to Google Earth over a local NetworkLink.
+
+The save is converted in-process whenever it changes and the results are
+kept in memory as KML, gzip-compressed KML and KMZ, each with an ETag.
+Requests only ever read that cache, so polling clients cost a lookup and,
+when nothing changed, a 304:
+
+    python -m sotn.server TS_Save_48.json --port 8089 --interval 60
+
+Open http://localhost:8089/root.kml in Google Earth (Add > Network Link).
+`save` may also be a folder, in which case its newest save (*.json, *.json.gz,
+*.json.zst) is served.
+"""
+import argparse
+import glob
+import gzip
+import hashlib
+import io
+import os
+import threading
+import time
+import zipfile
+from urllib.parse import urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from sotn import jsonio
+from sotn.layers import LAYERS, renderLayer
+from sotn.saveindex import SaveIndex
+
+SAVE_PATTERNS = ('*.json', '*.json.gz', '*.json.zst')
+
+class Entry:
+    __slots__ = ('etag', 'body', 'gzipped', 'kmz')
+
+    def __init__(self, body):
+        self.body = body
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.gzipped = gzip.compress(body, 6)
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as kmz:
+            kmz.writestr('doc.kml', body)
+        self.kmz = buffer.getvalue()
+
+def rootKml(interval, kmz=False):
+    extension = 'kmz' if kmz else 'kml'
+    links = ''.join(
+        f"""
+    <NetworkLink>
+      <name>{layer}</name>
+      <Link>
+        <href>{layer}.{extension}</href>
+        <refreshMode>onInterval</refreshMode>
+        <refreshInterval>{interval}</refreshInterval>
+      </Link>
+    </NetworkLink>"""
+        for layer in LAYERS
+    )
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2">
+  <Document>
+    <name>SOTN</name>{links}
+  </Document>
+</kml>
+""".encode('utf-8')
+
+class LayerCache:
+    """Latest rendered layers; rebuilt by a watcher thread, read lock-free."""
+
+    def __init__(self, save, interval, kmz=False):
+        self.save = save
+        self.entries = {'root': Entry(rootKml(interval, kmz))}
+        self.stamp = None
+
+    def currentSave(self):
+        if os.path.isdir(self.save):
+            saves = [path for pattern in SAVE_PATTERNS for path in glob.glob(os.path.join(self.save, pattern))]
+            return max(saves, key=os.path.getmtime) if saves else None
+        return self.save
+
+    def refresh(self):
+        path = self.currentSave()
+        if path is None:
+            return False
+        stat = os.stat(path)
+        stamp = (path, stat.st_mtime_ns, stat.st_size)
+        if stamp == self.stamp:
+            return False
+        ttsState = jsonio.load(path)
+        index = SaveIndex(ttsState)
+        entries = dict(self.entries)
+        for layer in LAYERS:
+            body = renderLayer(layer, ttsState, os.path.splitext(os.path.basename(path))[0], index)
+            if body is None:
+                # the current save has no such map; stop serving the previous save's
+                print(f"{layer} not found in {path}")
+                entries.pop(layer, None)
+                continue
+            if layer not in entries or entries[layer].body != body:
+                entries[layer] = Entry(body)
+        # a single reference swap, so handlers see either the old or the new set
+        self.entries = entries
+        self.stamp = stamp
+        print(f"Loaded {path}")
+        return True
+
+    def watch(self, period):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                # e.g. a save caught half-written; keep serving the last good layers and retry
+                print(f"Reload failed: {type(e).__name__}: {e}")
+            time.sleep(period)
+
+def makeHandler(cache):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            name, _, extension = urlsplit(self.path).path.lstrip('/').partition('.')
+            entry = cache.entries.get(name)
+            if entry is None or extension not in ('kml', 'kmz'):
+                self.send_error(404)
+                return
+            # each representation gets its own strong ETag
+            gzipped = extension == 'kml' and 'gzip' in self.headers.get('Accept-Encoding', '')
+            if extension == 'kmz':
+                body, etag = entry.kmz, f'"{entry.etag}-kmz"'
+            elif gzipped:
+                body, etag = entry.gzipped, f'"{entry.etag}-gzip"'
+            else:
+                body, etag = entry.body, f'"{entry.etag}"'
+            headers = [('ETag', etag), ('Cache-Control', 'no-cache')]
+            if extension == 'kml':
+                headers.append(('Vary', 'Accept-Encoding'))
+            if etag in [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]:
+                self.send_response(304)
+                for header in headers:
+                    self.send_header(*header)
+                self.end_headers()
+                return
+            self.send_response(200)
+            for header in headers:
+                self.send_header(*header)
+            if extension == 'kmz':
+                self.send_header('Content-Type', 'application/vnd.google-earth.kmz')
+            else:
+                self.send_header('Content-Type', 'application/vnd.google-earth.kml+xml')
+                if gzipped:
+                    self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('save', help='save file, or folder whose newest save is served')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--interval', type=int, default=60, help='NetworkLink refresh interval in seconds')
+    parser.add_argument('--kmz', action='store_true', help='link KMZ instead of KML from root.kml')
+    args = parser.parse_args(argv)
+
+    cache = LayerCache(args.save, args.interval, args.kmz)
+    cache.refresh()
+    threading.Thread(target=cache.watch, args=(max(1, args.interval // 2),), daemon=True).start()
+    server = ThreadingHTTPServer((args.host, args.port), makeHandler(cache))
+    print(f"Serving http://{args.host}:{args.port}/root.kml")
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+"""Columnar store of extracted unit positions, one row per unit per layer per turn.
+
+Each column is a flat little-endian binary file that conversions append to
+and queries read through numpy.memmap, so lookups never touch a save again.
+GUIDs, nicknames and image URLs go through an append-only string table
+(strings.jsonl, one JSON string per line, id = line number).
+
+    python -m sotn.snapshots STORE where GUID [--turn N]
+    python -m sotn.snapshots STORE box TURN WEST SOUTH EAST NORTH [--faction WP] [--layer StratMap]
+"""
+import argparse
+import hashlib
+import os
+
+import numpy as np
+
+from sotn import jsonio
+from sotn.layers import LAYERS
+from sotn.records import toArrays
+
+COLUMNS = (
+    ('turn', '<i4'), ('guid', '<i4'), ('nickname', '<i4'), ('image', '<i4'),
+    ('layer', 'u1'), ('faction', 'u1'),
+    ('lon', '<f8'), ('lat', '<f8'), ('x', '<f4'), ('z', '<f4'),
+)
+FACTIONS = ('', 'NATO', 'WP', 'Marker')
+
+def factionCode(unit):
+    for code, tag in enumerate(FACTIONS[1:], 1):
+        if unit.hasTag(tag):
+            return code
+    return 0
+
+def fileHash(path):
+    """SHA-1 of the save's JSON, so a compressed copy of a save gets the same turn."""
+    digest = hashlib.sha1()
+    with jsonio.openSave(path) as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class SnapshotStore:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.strings = []
+        self.stringIds = {}
+        stringsPath = self._path('strings.jsonl')
+        if os.path.exists(stringsPath):
+            with open(stringsPath, encoding='utf-8') as f:
+                for line in f:
+                    value = jsonio.loads(line)
+                    self.stringIds.setdefault(value, len(self.strings))
+                    self.strings.append(value)
+        savesPath = self._path('saves.json')
+        self.saves = {}
+        if os.path.exists(savesPath):
+            self.saves = jsonio.load(savesPath)
+        self._columns = None
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def turnFor(self, saveHash):
+        """Turn number of a save; the first time a save is seen it gets the next turn."""
+        if saveHash not in self.saves:
+            self.saves[saveHash] = len(self.saves)
+            tmp = self._path('saves.json.tmp')
+            jsonio.dump(self.saves, tmp, indent=4)
+            os.replace(tmp, self._path('saves.json'))
+        return self.saves[saveHash]
+
+    def _intern(self, value, pending):
+        value = value or ''
+        sid = self.stringIds.get(value)
+        if sid is None:
+            sid = self.stringIds[value] = len(self.strings)
+            self.strings.append(value)
+            pending.append(value)
+        return sid
+
+    def stored(self, turn, layer):
+        """Whether rows of layer at turn are already in the store."""
+        c = self.columns
+        return bool(np.any((c['turn'] == turn) & (c['layer'] == LAYERS.index(layer))))
+
+    def append(self, turn, layer, units):
+        """Append the UnitRecords a layer's extractUnits() returned; returns the rows written.
+
+        A turn's save is identified by its content hash, so a layer already
+        stored for that turn is the same conversion run again and is skipped.
+        """
+        if self.stored(turn, layer):
+            return 0
+        pending = []
+        rows = toArrays(units)
+        rows['turn'] = np.full(len(units), turn)
+        rows['layer'] = np.full(len(units), LAYERS.index(layer))
+        rows['guid'] = [self._intern(unit.guid, pending) for unit in units]
+        rows['nickname'] = [self._intern(unit.name, pending) for unit in units]
+        rows['image'] = [self._intern(unit.image, pending) for unit in units]
+        rows['faction'] = [factionCode(unit) for unit in units]
+
+        # strings first, so every id written to a column resolves
+        with open(self._path('strings.jsonl'), 'a', encoding='utf-8') as f:
+            for value in pending:
+                f.write(jsonio.dumps(value) + '\n')
+        for name, dtype in COLUMNS:
+            with open(self._path(f'{name}.bin'), 'ab') as f:
+                np.asarray(rows[name], dtype=dtype).tofile(f)
+        self._columns = None
+        return len(units)
+
+    @property
+    def columns(self):
+        """Read-only memory-mapped columns, truncated to the shortest one."""
+        if self._columns is None:
+            sizes = {}
+            for name, dtype in COLUMNS:
+                path = self._path(f'{name}.bin')
+                sizes[name] = os.path.getsize(path) // np.dtype(dtype).itemsize if os.path.exists(path) else 0
+            rows = min(sizes.values())
+            self._columns = {
+                name: np.memmap(self._path(f'{name}.bin'), dtype=dtype, mode='r', shape=(rows,))
+                if rows else np.empty(0, dtype=dtype)
+                for name, dtype in COLUMNS
+            }
+        return self._columns
+
+    def _records(self, rows):
+        c = self.columns
+        return [
+            {
+                'turn': int(c['turn'][i]), 'guid': self.strings[c['guid'][i]],
+                'nickname': self.strings[c['nickname'][i]], 'image': self.strings[c['image'][i]],
+                'layer': LAYERS[c['layer'][i]], 'faction': FACTIONS[c['faction'][i]],
+                'lon': float(c['lon'][i]), 'lat': float(c['lat'][i]),
+                'x': float(c['x'][i]), 'z': float(c['z'][i]),
+            }
+            for i in rows
+        ]
+
+    def where(self, guid, turn=None):
+        """Positions of unit `guid`, on every layer, at `turn` (or every turn)."""
+        sid = self.stringIds.get(guid)
+        if sid is None:
+            return []
+        c = self.columns
+        mask = c['guid'] == sid
+        if turn is not None:
+            mask &= c['turn'] == turn
+        return self._records(np.flatnonzero(mask))
+
+    def inBox(self, turn, west, south, east, north, faction=None, layer=None):
+        """Units at `turn` whose lon/lat lies inside the box."""
+        c = self.columns
+        mask = c['turn'] == turn
+        if faction is not None:
+            mask &= c['faction'] == FACTIONS.index(faction)
+        if layer is not None:
+            mask &= c['layer'] == LAYERS.index(layer)
+        lon = c['lon']
+        lat = c['lat']
+        mask &= (lon >= west) & (lon <= east) & (lat >= south) & (lat <= north)
+        return self._records(np.flatnonzero(mask))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('store')
+    commands = parser.add_subparsers(dest='command', required=True)
+    where = commands.add_parser('where')
+    where.add_argument('guid')
+    where.add_argument('--turn', type=int)
+    box = commands.add_parser('box')
+    box.add_argument('turn', type=int)
+    for edge in ('west', 'south', 'east', 'north'):
+        box.add_argument(edge, type=float)
+    box.add_argument('--faction', choices=FACTIONS[1:])
+    box.add_argument('--layer', choices=LAYERS)
+    args = parser.parse_args(argv)
+
+    store = SnapshotStore(args.store)
+    if args.command == 'where':
+        records = store.where(args.guid, args.turn)
+    else:
+        records = store.inBox(args.turn, args.west, args.south, args.east, args.north, args.faction, args.layer)
+    for record in records:
+        print(jsonio.dumps(record))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Split a layer into a quadtree of KML documents gated by Region/Lod.
+
+Tile assignment is computed once for all units: each position is quantised
+to the deepest grid, the cell indices are interleaved into a Morton code and
+the units are sorted by it, so every quadtree node is a contiguous slice
+found with searchsorted. Nodes holding more than `maxPerTile` units are
+split; leaves are rendered with the layer's own createKmlDoc.
+"""
+import os
+
+import numpy as np
+from lxml import etree
+from pykml.factory import KML_ElementMaker as KML
+
+from sotn.bounds import outline
+from sotn.records import toArrays
+
+def layerBounds(crs, samples=9):
+    """(west, south, east, north) of the layer's bounds (box or polygon) in lon/lat.
+
+    The edges are sampled rather than just the corners because the quadratic
+    fits bend them.
+    """
+    corners = outline(crs.data['bounds'])
+    t = np.linspace(0.0, 1.0, samples)[:, None, None]
+    points = (corners + t * (np.roll(corners, -1, axis=0) - corners)).reshape(-1, 2)
+    lon, lat = crs.relativeToLoLa(points[:, 0], points[:, 1])
+    return float(np.min(lon)), float(np.min(lat)), float(np.max(lon)), float(np.max(lat))
+
+def interleave(ix, iy, bits):
+    code = np.zeros(ix.shape, dtype=np.int64)
+    for b in range(bits):
+        code |= ((ix >> b) & 1) << (2 * b)
+        code |= ((iy >> b) & 1) << (2 * b + 1)
+    return code
+
+class QuadTree:
+    def __init__(self, lons, lats, bounds, maxDepth=6):
+        self.bounds = bounds
+        self.maxDepth = maxDepth
+        west, south, east, north = bounds
+        cells = 1 << maxDepth
+        ix = np.clip(((lons - west) / (east - west) * cells).astype(np.int64), 0, cells - 1)
+        iy = np.clip(((lats - south) / (north - south) * cells).astype(np.int64), 0, cells - 1)
+        codes = interleave(ix, iy, maxDepth)
+        self.order = np.argsort(codes, kind='stable')
+        self.codes = codes[self.order]
+
+    def members(self, depth, tx, ty):
+        """Indices (into the input arrays) of the units inside tile (depth, tx, ty)."""
+        shift = 2 * (self.maxDepth - depth)
+        prefix = int(interleave(np.array([tx]), np.array([ty]), depth)[0])
+        lo, hi = np.searchsorted(self.codes, [prefix << shift, (prefix + 1) << shift])
+        return self.order[lo:hi]
+
+    def box(self, depth, tx, ty):
+        west, south, east, north = self.bounds
+        width = (east - west) / (1 << depth)
+        height = (north - south) / (1 << depth)
+        return (west + tx * width, south + ty * height, west + (tx + 1) * width, south + (ty + 1) * height)
+
+def region(box, minLodPixels):
+    west, south, east, north = box
+    return KML.Region(
+        KML.LatLonAltBox(KML.north(north), KML.south(south), KML.east(east), KML.west(west)),
+        KML.Lod(KML.minLodPixels(minLodPixels), KML.maxLodPixels(-1)),
+    )
+
+def writeTiles(directory, layer, units, bounds, createKmlDoc, maxPerTile=200, maxDepth=6, minLodPixels=128):
+    """Write <directory>/<layer>.kml plus its tiles; returns the number of leaf tiles."""
+    os.makedirs(os.path.join(directory, 'tiles'), exist_ok=True)
+    columns = toArrays(units)
+    tree = QuadTree(columns['lon'], columns['lat'], bounds, maxDepth)
+    leaves = 0
+
+    def write(path, doc):
+        with open(path, 'wb') as out:
+            out.write(etree.tostring(doc, pretty_print=True, encoding="utf-8"))
+
+    def build(depth, tx, ty, members):
+        nonlocal leaves
+        name = f'{layer} {depth}/{tx}/{ty}'
+        if len(members) <= maxPerTile or depth == maxDepth:
+            leaves += 1
+            doc = createKmlDoc(name, [units[i] for i in members])
+            if depth:
+                document = doc.Document
+                document.insert(document.index(document.Folder), region(tree.box(depth, tx, ty), minLodPixels))
+            return doc
+        links = []
+        for dy in (0, 1):
+            for dx in (0, 1):
+                cx, cy = 2 * tx + dx, 2 * ty + dy
+                child = tree.members(depth + 1, cx, cy)
+                if not len(child):
+                    continue
+                href = f'{depth + 1}_{cx}_{cy}.kml'
+                write(os.path.join(directory, 'tiles', href), build(depth + 1, cx, cy, child))
+                links.append(KML.NetworkLink(
+                    KML.name(f'{depth + 1}/{cx}/{cy}'),
+                    region(tree.box(depth + 1, cx, cy), minLodPixels),
+                    KML.Link(KML.href(href if depth else f'tiles/{href}'), KML.viewRefreshMode('onRegion')),
+                ))
+        children = [region(tree.box(depth, tx, ty), minLodPixels)] if depth else []
+        return KML.kml(KML.Document(KML.name(name), *children, *links))
+
+    write(os.path.join(directory, f'{layer}.kml'), build(0, 0, 0, tree.members(0, 0, 0)))
+    return leaves
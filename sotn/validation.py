@@ -0,0 +1,129 @@
+"""Leave-one-out validation of a calibration fit.
+
+For a least-squares fit y = X b the leave-one-out residual of point i is
+e_i / (1 - h_ii), where e is the ordinary residual and h_ii the diagonal of
+the hat matrix X (X^T X)^-1 X^T. Taking h from a thin QR of X gives every
+LOO residual from the single fit, with no refitting per marker.
+
+A RANSAC fit is validated on the inliers it was refitted on; a rejected
+marker was never in that fit, so its residual is already out of sample and
+serves as its LOO residual too.
+"""
+import os
+
+import numpy as np
+
+from sotn import jsonio
+
+EARTH_RADIUS_M = 6371008.8
+
+def looResiduals(X, y, inliers=None):
+    """(residuals, leave-one-out residuals, leverages) of the least-squares fit of y on X.
+
+    With an inliers mask only those rows are fitted; the other rows get
+    their out-of-sample residual as both residual and LOO residual.
+    """
+    X = np.asarray(X, dtype=float)
+    y = np.asarray(y, dtype=float).ravel()
+    inliers = np.ones(len(y), bool) if inliers is None else np.asarray(inliers, bool)
+    Q, R = np.linalg.qr(X[inliers])
+    coefficients = np.linalg.lstsq(R, Q.T @ y[inliers], rcond=None)[0]
+    residuals = y - X @ coefficients
+    leverage = np.empty(len(y))
+    leverage[inliers] = np.einsum('ij,ij->i', Q, Q)
+    if not inliers.all():
+        # x (X^T X)^-1 x^T of a row outside the fit
+        Z = np.linalg.lstsq(R.T, X[~inliers].T, rcond=None)[0]
+        leverage[~inliers] = np.einsum('ij,ij->j', Z, Z)
+    loo = residuals.copy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        loo[inliers] = residuals[inliers] / (1.0 - leverage[inliers])
+    # a marker with leverage 1 decides its own fit; it cannot be validated
+    loo[inliers & (leverage > 1.0 - 1e-9)] = np.inf
+    return residuals, loo, leverage
+
+def metres(dLon, dLat, lat):
+    """Length in metres of small lon/lat offsets (equirectangular at lat)."""
+    k = np.pi / 180.0 * EARTH_RADIUS_M
+    return np.hypot(dLon * k * np.cos(np.radians(lat)), dLat * k)
+
+def validationReport(layer, names, designs, lonLat, predicted=None, outlierSigma=3.0, inliers=None):
+    """Per-marker and per-layer errors in metres.
+
+    designs is the (longitude, latitude) pair of design matrices the
+    calibration fits, lonLat the reference town coordinates and predicted
+    the positions the written tts2lola.json gives each marker. inliers is
+    the (longitude, latitude) pair of RANSAC inlier masks the written fit
+    was refitted on; markers rejected by either are outliers and are left
+    out of the fit and LOO RMSE.
+    """
+    lonLat = np.asarray(lonLat, dtype=float)
+    inliers = inliers or (None, None)
+    fitLon, looLon, levLon = looResiduals(designs[0], lonLat[:, 0], inliers[0])
+    fitLat, looLat, levLat = looResiduals(designs[1], lonLat[:, 1], inliers[1])
+    fitError = metres(fitLon, fitLat, lonLat[:, 1])
+    looError = metres(looLon, looLat, lonLat[:, 1])
+    rejected = np.zeros(len(names), bool)
+    for mask in inliers:
+        if mask is not None:
+            rejected |= ~np.asarray(mask, bool)
+
+    finite = looError[np.isfinite(looError) & ~rejected]
+    median = float(np.median(finite)) if len(finite) else 0.0
+    mad = float(np.median(np.abs(finite - median))) if len(finite) else 0.0
+    threshold = median + outlierSigma * 1.4826 * mad
+    # leverage-1 markers have no LOO residual; they are not estimable, not outliers
+    estimable = np.isfinite(looError)
+    outliers = rejected | (estimable & (looError > threshold))
+
+    modelError = None
+    if predicted is not None:
+        predicted = np.asarray(predicted, dtype=float)
+        modelError = metres(predicted[:, 0] - lonLat[:, 0], predicted[:, 1] - lonLat[:, 1], lonLat[:, 1])
+
+    def rmse(errors):
+        errors = errors[np.isfinite(errors)]
+        return float(np.sqrt(np.mean(errors ** 2))) if len(errors) else None
+
+    markers = []
+    for i, name in enumerate(names):
+        marker = {
+            'name': name,
+            'fit_error_m': float(fitError[i]),
+            'loo_error_m': float(looError[i]) if np.isfinite(looError[i]) else None,
+            'leverage': [float(levLon[i]), float(levLat[i])],
+            'outlier': bool(outliers[i]),
+            'estimable': bool(estimable[i]),
+            'ransac_rejected': bool(rejected[i]),
+        }
+        if modelError is not None:
+            marker['model_error_m'] = float(modelError[i])
+        markers.append(marker)
+
+    report = {
+        'layer': layer,
+        'markers': len(names),
+        'parameters': [int(np.shape(designs[0])[1]), int(np.shape(designs[1])[1])],
+        'rmse_m': {'fit': rmse(fitError[~rejected]), 'loo': rmse(looError[~rejected])},
+        'outlier_threshold_m': threshold,
+        'outliers': [m['name'] for m in markers if m['outlier']],
+        'ransac_rejected': [m['name'] for m in markers if m['ransac_rejected']],
+        'not_estimable': [m['name'] for m in markers if not m['estimable']],
+        'points': markers,
+    }
+    if modelError is not None:
+        report['rmse_m']['model'] = rmse(modelError)
+    return report
+
+def writeReport(report, path='tts2lola_validation.json'):
+    jsonio.dump(report, path + '.tmp', indent=4)
+    os.replace(path + '.tmp', path)
+    rmse = report['rmse_m']
+    fit = 'n/a' if rmse['fit'] is None else f"{rmse['fit']:.0f} m"
+    loo = 'n/a (no marker is estimable)' if rmse['loo'] is None else f"{rmse['loo']:.0f} m"
+    unchecked = report.get('not_estimable', [])
+    rejected = report.get('ransac_rejected', [])
+    print(f"{report['layer']}: RMSE fit {fit}, leave-one-out {loo}, "
+          f"{len(report['outliers'])} outlier(s) {report['outliers']}"
+          + (f" ({len(rejected)} rejected by RANSAC)" if rejected else '')
+          + (f", {len(unchecked)} not estimable" if unchecked else '') + f" -> {path}")
@@ -0,0 +1,124 @@
+"""Read a VASSAL module (.vmod) directly: its piece palette and images.
+
+A .vmod is a zip archive. Its buildFile (buildFile.xml in newer modules) is
+parsed with iterparse while it is being decompressed, and every piece slot
+of the palette becomes a {'front_png', 'back_png'} leaf under the names of
+the windows, tabs and lists that contain it, the layout of the extracted
+Red_Strike_V1_2.vmod.json. Image members are not touched while parsing;
+extractImages() decompresses only the images asked for, and only those not
+already extracted.
+"""
+import os
+import re
+import shutil
+import xml.etree.ElementTree as ET
+import zipfile
+
+BUILD_FILES = ('buildFile.xml', 'buildFile')
+IMAGE_FOLDER = 'images/'
+# palette elements that group pieces, by the last part of their class name
+CONTAINERS = {'PieceWindow', 'TabWidget', 'ListWidget', 'PanelWidget', 'BoxWidget'}
+IMAGE = re.compile(r'[^;,\t/\\]+\.(?:png|gif|jpe?g|svg)', re.IGNORECASE)
+
+def pieceImages(definition):
+    """(front, back) image names of a piece slot's definition; back is '' for one-sided pieces.
+
+    The basic piece (the 'piece;' trait, innermost and so last) carries the
+    front; the first other image, typically a flip layer's, is the back.
+    """
+    front = ''
+    for trait in reversed(definition.split('\t')):
+        if trait.startswith('piece;'):
+            fields = trait.split(';')
+            front = fields[3] if len(fields) > 3 else ''
+            break
+    images = list(dict.fromkeys(IMAGE.findall(definition)))
+    if not front and images:
+        front = images[0]
+    back = next((image for image in images if image != front), '')
+    return front, back
+
+def isPiece(node):
+    return 'front_png' in node
+
+def find(tree, name):
+    """The shallowest group called name, or None."""
+    level = [tree]
+    while level:
+        for node in level:
+            if name in node and not isPiece(node[name]):
+                return node[name]
+        level = [child for node in level for child in node.values() if not isPiece(child)]
+    return None
+
+def pieces(tree):
+    """(name, piece) of every piece under tree, in palette order."""
+    for name, node in tree.items():
+        if isPiece(node):
+            yield name, node
+        else:
+            yield from pieces(node)
+
+class VassalModule:
+    def __init__(self, path):
+        self.path = path
+        self.zip = zipfile.ZipFile(path)
+        names = set(self.zip.namelist())
+        self.buildFile = next((name for name in BUILD_FILES if name in names), None)
+        if self.buildFile is None:
+            raise ValueError(f'{path}: no buildFile, not a VASSAL module')
+        self.images = {info.filename[len(IMAGE_FOLDER):]: info for info in self.zip.infolist()
+                       if info.filename.startswith(IMAGE_FOLDER) and not info.is_dir()}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.zip.close()
+
+    def palette(self):
+        """Nested {group: {...: {piece: {'front_png', 'back_png'}}}} of the piece palette."""
+        tree = {}
+        stack = [tree]
+        with self.zip.open(self.buildFile) as f:
+            for event, element in ET.iterparse(f, events=('start', 'end')):
+                kind = element.tag.rsplit('.', 1)[-1]
+                if kind in CONTAINERS:
+                    if event == 'start':
+                        name = element.get('entryName') or element.get('name') or ''
+                        stack.append(stack[-1].setdefault(name, {}))
+                    else:
+                        stack.pop()
+                        element.clear()
+                elif kind == 'PieceSlot' and event == 'end':
+                    front, back = pieceImages(element.text or '')
+                    stack[-1][element.get('entryName') or ''] = {'front_png': front, 'back_png': back}
+                    element.clear()
+        return tree
+
+    def extractImages(self, names, directory):
+        """Extract the named images into directory; returns {name: path} of those in the module.
+
+        An image already there with the member's size is left alone; names
+        that would resolve outside directory (e.g. '../x.png') are skipped.
+        """
+        os.makedirs(directory, exist_ok=True)
+        root = os.path.realpath(directory)
+        paths = {}
+        for name in names:
+            info = self.images.get(name)
+            if info is None:
+                continue
+            path = os.path.realpath(os.path.join(root, name))
+            if os.path.commonpath([root, path]) != root or path == root:
+                continue
+            if not os.path.exists(path) or os.path.getsize(path) != info.file_size:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with self.zip.open(info) as member, open(path + '.tmp', 'wb') as out:
+                    shutil.copyfileobj(member, out)
+                os.replace(path + '.tmp', path)
+            paths[name] = path
+        return paths
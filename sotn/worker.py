@@ -0,0 +1,303 @@
+"""Local conversion service: upload a save over HTTP, get the three layers back.
+
+    python -m sotn.worker --data-dir conversions --workers 3 --max-queue 16
+
+    curl --data-binary @TS_Save_48.json 'http://localhost:8090/jobs?name=TS_Save_48'
+    curl http://localhost:8090/jobs/<id>             # status and metrics
+    curl -O http://localhost:8090/jobs/<id>/TacMap.kml
+    curl http://localhost:8090/metrics
+
+A job's id is the SHA-1 of the uploaded save and of the conversion itself
+(each layer's TTS2KML.py and tts2lola.json, and the sotn modules and
+classification rules), so an upload identical to one already converted
+with the same transforms (or still in progress) is answered by the existing
+job without converting again, and a recalibrated layer gets new results. Conversions run in a process pool; at most
+--max-queue jobs may be waiting or running, beyond that uploads get 503
+with Retry-After before their body is read. Results are kept under
+--data-dir and survive restarts.
+"""
+import argparse
+import glob
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from sotn import jsonio
+from sotn.layers import LAYERS, ROOT, layerDir, renderLayer
+from sotn.saveindex import SaveIndex
+
+MAX_UPLOAD = 512 << 20
+JOB_PATH = re.compile(r'^/jobs/([0-9a-f]{40})(?:/(\w+)\.kml)?$')
+
+_fileHashes = {}
+
+def conversionFiles():
+    """The files a conversion's output depends on, besides the save."""
+    files = [os.path.join(layerDir(layer), name) for layer in LAYERS for name in ('TTS2KML.py', 'tts2lola.json')]
+    files += sorted(glob.glob(os.path.join(ROOT, 'sotn', '*.py')))
+    files.append(os.path.join(ROOT, 'sotn', 'classification.json'))
+    return files
+
+def conversionKey():
+    """SHA-1 over conversionFiles(); each file is rehashed only when its size or mtime changes."""
+    key = hashlib.sha1()
+    for path in conversionFiles():
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            key.update(f'{path}:missing'.encode('utf-8'))
+            continue
+        signature = (stat.st_size, stat.st_mtime_ns)
+        cached = _fileHashes.get(path)
+        if cached is None or cached[0] != signature:
+            with open(path, 'rb') as f:
+                cached = _fileHashes[path] = (signature, hashlib.sha1(f.read()).hexdigest())
+        key.update(f'{os.path.relpath(path, ROOT)}:{cached[1]}'.encode('utf-8'))
+    return key.hexdigest()
+
+def jobId(body):
+    return hashlib.sha1(body + conversionKey().encode('ascii')).hexdigest()
+
+def convertSave(savePath, outDir, missionName):
+    """Worker process: convert one save into outDir/<Layer>.kml, return metrics."""
+    metrics = {'started': time.time(), 'layers': {}}
+    with open(os.path.join(outDir, 'started'), 'w') as f:
+        f.write(str(metrics['started']))
+    start = time.perf_counter()
+    ttsState = jsonio.load(savePath)
+    index = SaveIndex(ttsState)
+    metrics['parseSeconds'] = round(time.perf_counter() - start, 4)
+    for layer in LAYERS:
+        start = time.perf_counter()
+        body = renderLayer(layer, ttsState, missionName, index)
+        if body is not None:
+            with open(os.path.join(outDir, f'{layer}.kml'), 'wb') as f:
+                f.write(body)
+        metrics['layers'][layer] = {
+            'seconds': round(time.perf_counter() - start, 4),
+            'bytes': None if body is None else len(body),
+        }
+    return metrics
+
+class Job:
+    STORED = ('id', 'name', 'status', 'submitted', 'finished', 'error', 'metrics')
+
+    def __init__(self, id, name, outDir=None):
+        self.id = id
+        self.name = name
+        self.outDir = outDir
+        self.status = 'queued'
+        self.submitted = time.time()
+        self.finished = None
+        self.uploads = 1
+        self.error = None
+        self.metrics = {}
+
+    def toDict(self):
+        info = {k: getattr(self, k) for k in ('id', 'name', 'status', 'uploads', 'error', 'metrics')}
+        if self.status == 'queued' and self.outDir and os.path.exists(os.path.join(self.outDir, 'started')):
+            info['status'] = 'running'
+        if self.finished:
+            if 'started' in self.metrics:
+                info['queueSeconds'] = round(self.metrics['started'] - self.submitted, 4)
+            info['totalSeconds'] = round(self.finished - self.submitted, 4)
+        if self.status == 'done':
+            info['layers'] = [l for l, m in self.metrics['layers'].items() if m['bytes'] is not None]
+        return info
+
+class Service:
+    def __init__(self, dataDir, workers=None, maxQueue=16):
+        self.dataDir = dataDir
+        self.maxQueue = maxQueue
+        self.pool = ProcessPoolExecutor(workers)
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.pending = 0
+        self.counters = dict.fromkeys(('submitted', 'deduplicated', 'rejected', 'completed', 'failed'), 0)
+        os.makedirs(os.path.join(dataDir, 'uploads'), exist_ok=True)
+        os.makedirs(os.path.join(dataDir, 'results'), exist_ok=True)
+
+    def resultDir(self, id):
+        return os.path.join(self.dataDir, 'results', id)
+
+    def _known(self, id):
+        """job(), for a caller holding the lock."""
+        job = self.jobs.get(id)
+        if job is None:
+            path = os.path.join(self.resultDir(id), 'job.json')
+            if os.path.exists(path):
+                job = self.jobs[id] = Job(id, None)
+                job.__dict__.update(jsonio.load(path))
+        return job
+
+    def job(self, id):
+        """In-memory job, or one finished by an earlier run of the service."""
+        with self.lock:
+            return self._known(id)
+
+    def full(self):
+        """Whether an upload would be turned away; counted as rejected if so."""
+        with self.lock:
+            if self.pending < self.maxQueue:
+                return False
+            self.counters['submitted'] += 1
+            self.counters['rejected'] += 1
+            return True
+
+    def submit(self, body, name):
+        """(job, created) for an upload; job is None when the queue is full."""
+        id = jobId(body)
+        with self.lock:
+            # looked up and inserted under one lock, so identical uploads share a job
+            job = self._known(id)
+            self.counters['submitted'] += 1
+            if job is not None and job.status != 'failed':
+                job.uploads += 1
+                self.counters['deduplicated'] += 1
+                return job, False
+            if self.pending >= self.maxQueue:
+                self.counters['rejected'] += 1
+                return None, False
+            outDir = tempfile.mkdtemp(dir=os.path.join(self.dataDir, 'results'))
+            job = self.jobs[id] = Job(id, name or id[:8], outDir)
+            self.pending += 1
+        savePath = os.path.join(self.dataDir, 'uploads', id + '.json')
+        try:
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(savePath))
+            with os.fdopen(fd, 'wb') as f:
+                f.write(body)
+            os.replace(tmp, savePath)
+            future = self.pool.submit(convertSave, savePath, outDir, job.name)
+        except Exception as e:
+            # e.g. BrokenProcessPool: the job never reaches finish(), so undo its place in the queue here
+            job.finished = time.time()
+            job.status, job.error = 'failed', f'{type(e).__name__}: {e}'
+            job.outDir = None
+            shutil.rmtree(outDir, ignore_errors=True)
+            if os.path.exists(savePath):
+                os.remove(savePath)
+            with self.lock:
+                self.pending -= 1
+                self.counters['failed'] += 1
+            return job, True
+        future.add_done_callback(lambda f: self.finish(job, f, savePath))
+        return job, True
+
+    def finish(self, job, future, savePath):
+        job.finished = time.time()
+        try:
+            job.metrics = future.result()
+            job.status = 'done'
+            os.remove(os.path.join(job.outDir, 'started'))
+            jsonio.dump({k: getattr(job, k) for k in Job.STORED}, os.path.join(job.outDir, 'job.json'))
+            os.replace(job.outDir, self.resultDir(job.id))
+        except Exception as e:
+            job.status, job.error = 'failed', f'{type(e).__name__}: {e}'
+            shutil.rmtree(job.outDir, ignore_errors=True)
+        job.outDir = None
+        os.remove(savePath)
+        with self.lock:
+            self.pending -= 1
+            self.counters['completed' if job.status == 'done' else 'failed'] += 1
+
+    def metrics(self):
+        with self.lock:
+            jobs = list(self.jobs.values())
+            info = dict(self.counters, pending=self.pending, maxQueue=self.maxQueue)
+        states = [j.toDict()['status'] for j in jobs]
+        info['queued'], info['running'] = states.count('queued'), states.count('running')
+        done = [j for j in jobs if j.status == 'done' and j.metrics]
+        if done:
+            info['meanParseSeconds'] = round(sum(j.metrics['parseSeconds'] for j in done) / len(done), 4)
+        return info
+
+def makeHandler(service):
+    class Handler(BaseHTTPRequestHandler):
+        def sendJson(self, code, data, headers=()):
+            body = jsonio.dumps(data, fast=True).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for header in headers:
+                self.send_header(*header)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            url = urlsplit(self.path)
+            if url.path != '/jobs':
+                self.send_error(404)
+                return
+            length = int(self.headers.get('Content-Length') or 0)
+            if not 0 < length <= MAX_UPLOAD:
+                self.send_error(411 if not length else 413)
+                return
+            if service.full():
+                # refused before the body is read; the connection is closed instead of drained
+                self.close_connection = True
+                self.sendJson(503, {'error': 'queue full'}, [('Retry-After', '30'), ('Connection', 'close')])
+                return
+            body = self.rfile.read(length)
+            name = parse_qs(url.query).get('name', [None])[0]
+            job, created = service.submit(body, name)
+            if job is None:
+                self.sendJson(503, {'error': 'queue full'}, [('Retry-After', '30')])
+            else:
+                self.sendJson(202 if job.status == 'queued' else 200, dict(job.toDict(), created=created),
+                              [('Location', f'/jobs/{job.id}')])
+
+        def do_GET(self):
+            path = urlsplit(self.path).path
+            if path == '/metrics':
+                self.sendJson(200, service.metrics())
+                return
+            match = JOB_PATH.match(path)
+            job = match and service.job(match.group(1))
+            if job is None:
+                self.send_error(404)
+                return
+            layer = match.group(2)
+            if layer is None:
+                self.sendJson(200, job.toDict())
+                return
+            kml = os.path.join(service.resultDir(job.id), f'{layer}.kml')
+            if job.status != 'done' or layer not in LAYERS or not os.path.exists(kml):
+                self.send_error(404)
+                return
+            with open(kml, 'rb') as f:
+                body = f.read()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/vnd.google-earth.kml+xml')
+            self.send_header('ETag', f'"{job.id}-{layer}"')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--data-dir', default='conversions', help='uploads and results are kept here')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--workers', type=int, default=None, help='conversion processes (default: CPU count)')
+    parser.add_argument('--max-queue', type=int, default=16, help='jobs waiting or running before uploads are refused')
+    args = parser.parse_args(argv)
+
+    service = Service(args.data_dir, args.workers, args.max_queue)
+    server = ThreadingHTTPServer((args.host, args.port), makeHandler(service))
+    print(f"Accepting saves on http://{args.host}:{args.port}/jobs")
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
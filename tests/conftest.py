@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+@pytest.fixture
+def samplePath():
+    """A small generated save with all three maps, units of every faction, bags and a drawn line."""
+    return os.path.join(DATA, 'SampleScenario.json')
@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+from sotn.atlas import fileUrl, packDeck
+
+REMOTE_BACK = 'https://steamusercontent-a.akamaihd.net/ugc/1/back/'
+
+@pytest.fixture
+def images(tmp_path):
+    """{name: path} of small solid-colour PNGs."""
+    from PIL import Image
+
+    paths = {}
+    for name, colour in (('face1', (255, 0, 0, 255)), ('face2', (0, 255, 0, 255)), ('back', (0, 0, 255, 255))):
+        paths[name] = str(tmp_path / f'{name}.png')
+        Image.new('RGBA', (8, 12), colour).save(paths[name])
+    return paths
+
+def test_deck_default_back_is_used_for_cards_without_one(tmp_path, images):
+    out = tmp_path / 'deck'
+    sheets = packDeck(str(out), 'NATO', [(images['face1'], ''), (images['face2'], '')], back=REMOTE_BACK)
+    assert [sheet['BackURL'] for sheet in sheets] == [REMOTE_BACK]
+    assert not (out / 'NATO_back.png').exists()
+
+def test_card_back_wins_and_is_copied(tmp_path, images):
+    from PIL import Image
+
+    out = tmp_path / 'deck'
+    sheets = packDeck(str(out), 'NATO', [(images['face1'], ''), (images['face2'], images['back'])], back=REMOTE_BACK)
+    backPath = str(out / 'NATO_back.png')
+    assert sheets[0]['BackURL'] == fileUrl(backPath)
+    with Image.open(backPath) as back:
+        assert back.convert('RGBA').getpixel((0, 0)) == (0, 0, 255, 255)
+
+def test_deck_without_any_back_fails(tmp_path, images):
+    with pytest.raises(ValueError):
+        packDeck(str(tmp_path / 'deck'), 'NATO', [(images['face1'], ''), (images['face2'], '')])
+    assert not os.path.exists(tmp_path / 'deck')
+
+def test_sheets_are_split_by_grid_size(tmp_path, images):
+    cards = [(images['face1'], '')] * 5
+    sheets = packDeck(str(tmp_path / 'deck'), 'Pact', cards, columns=2, rows=1, back=REMOTE_BACK)
+    assert [sheet['count'] for sheet in sheets] == [2, 2, 1]
+    assert all((sheet['NumWidth'], sheet['NumHeight']) == (2, 1) for sheet in sheets)
@@ -0,0 +1,35 @@
+import pytest
+
+from sotn.classify import EXCLUDE, Classifier, classifierFor
+
+def tile(tags=None, nickname='Unit', script=''):
+    return {'Name': 'Custom_Tile', 'Nickname': nickname, 'Tags': tags, 'LuaScript': script}
+
+@pytest.mark.parametrize('obj, folder', [
+    (tile(['NATO']), 'NATO'),
+    (tile(['WP']), 'Pact'),
+    (tile(['Marker']), 'Undefined'),
+    (tile(['NATO', 'WP']), 'NATO'),
+    (tile(), 'Undefined'),
+    (tile(['Other']), None),
+    (tile(['NATO'], script='-- HQ SUPPLY token'), EXCLUDE),
+])
+def test_tacmap_rules(obj, folder):
+    assert classifierFor('TacMap').classify(obj) == folder
+
+def test_layer_restricted_rules():
+    stratMap = classifierFor('StratMap')
+    # the HQ Supply exclusion and the untagged rule only apply on TacMap
+    assert stratMap.classify(tile(['NATO'], script='HQ Supply')) == 'NATO'
+    assert stratMap.classify(tile()) is None
+
+def test_first_matching_rule_wins():
+    rules = [
+        {'nickname': r'^HQ\b', 'folder': 'Headquarters'},
+        {'tags': ['NATO'], 'script': ['reserve'], 'exclude': True},
+        {'tags': ['NATO'], 'folder': 'NATO'},
+    ]
+    classifier = Classifier(rules, 'TacMap')
+    assert classifier.classify(tile(['NATO'], nickname='HQ 3rd Bde')) == 'Headquarters'
+    assert classifier.classify(tile(['NATO'], script='In Reserve')) == EXCLUDE
+    assert classifier.classify(tile(['NATO'], nickname='3rd Bde')) == 'NATO'
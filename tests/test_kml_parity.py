@@ -0,0 +1,21 @@
+"""Each layer's converter against the KML the baseline TTS2KML.py wrote.
+
+tests/data/baseline/<Layer>.kml is the Sample.kml the original converter
+script produced from tests/data/SampleScenario.json with the layer's
+tts2lola.json; without drawn lines, which it did not export, the current
+converter must write the same bytes.
+"""
+import os
+
+import pytest
+
+from conftest import DATA
+from sotn.layers import LAYERS, loadConverter
+
+@pytest.mark.parametrize('layer', LAYERS)
+def test_matches_baseline(layer, samplePath, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    loadConverter(layer).main([samplePath, '--no-lines'])
+    with open(os.path.join(DATA, 'baseline', f'{layer}.kml'), 'rb') as f:
+        expected = f.read()
+    assert (tmp_path / 'Sample.kml').read_bytes() == expected
@@ -0,0 +1,20 @@
+from sotn import jsonio
+from sotn.server import LayerCache
+
+def test_refresh_follows_the_current_save(samplePath, tmp_path):
+    save = tmp_path / 'turn.json'
+    ttsState = jsonio.load(samplePath)
+    save.write_text(jsonio.dumps(ttsState))
+    cache = LayerCache(str(save), 60)
+    assert cache.refresh()
+    assert set(cache.entries) == {'root', 'TacMap', 'StratMap', 'OpMap'}
+    tacMap = cache.entries['TacMap']
+    assert not cache.refresh()
+
+    # the next save has no OpMap: that layer must 404 rather than serve the old KML
+    ttsState['ObjectStates'] = [obj for obj in ttsState['ObjectStates'] if obj.get('Nickname') != 'OpMap']
+    save.write_text(jsonio.dumps(ttsState, indent=1))
+    assert cache.refresh()
+    assert set(cache.entries) == {'root', 'TacMap', 'StratMap'}
+    # unchanged layers keep their entry, and so their ETags
+    assert cache.entries['TacMap'] is tacMap
@@ -0,0 +1,24 @@
+from sotn.records import UnitRecord, tagMask
+from sotn.snapshots import SnapshotStore
+
+def units(count, offset=0.0):
+    return [UnitRecord(f'g{i}', f'Unit {i}', tagMask(['NATO']), 'http://img/1.png',
+                       10.0 + i + offset, 50.0, float(i), 0.0, folder='NATO')
+            for i in range(count)]
+
+def test_append_is_idempotent_per_turn_and_layer(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    turn = store.turnFor('save-hash')
+    assert store.append(turn, 'TacMap', units(3)) == 3
+    assert store.append(turn, 'TacMap', units(3)) == 0
+    assert store.append(turn, 'StratMap', units(2)) == 2
+    assert len(store.columns['turn']) == 5
+
+    # a reopened store sees the rows on disk, and the same save keeps its turn
+    store = SnapshotStore(str(tmp_path))
+    assert store.turnFor('save-hash') == turn
+    assert store.append(turn, 'TacMap', units(3)) == 0
+    assert store.append(store.turnFor('next-save'), 'TacMap', units(3, 0.5)) == 3
+    assert len(store.columns['turn']) == 8
+    assert [(r['turn'], r['layer'], r['lon']) for r in store.where('g1')] == [
+        (turn, 'TacMap', 11.0), (turn, 'StratMap', 11.0), (turn + 1, 'TacMap', 11.5)]
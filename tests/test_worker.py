@@ -0,0 +1,53 @@
+import os
+import time
+
+import pytest
+
+from sotn import worker
+
+@pytest.fixture
+def service(tmp_path):
+    service = worker.Service(str(tmp_path / 'data'), workers=1, maxQueue=2)
+    yield service
+    service.pool.shutdown(cancel_futures=True)
+
+def wait(service, timeout=60):
+    deadline = time.monotonic() + timeout
+    while service.pending and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert service.pending == 0
+
+def test_job_id_follows_the_conversion_inputs(tmp_path, monkeypatch):
+    transform = tmp_path / 'tts2lola.json'
+    transform.write_text('{"easting": 1}')
+    monkeypatch.setattr(worker, 'conversionFiles', lambda: [str(transform)])
+    body = b'{"ObjectStates": []}'
+    first = worker.jobId(body)
+    assert worker.jobId(body) == first
+    assert worker.jobId(body + b' ') != first
+    # a recalibrated layer must not be answered from the old results
+    transform.write_text('{"easting": 1.5}')
+    assert worker.jobId(body) != first
+
+def test_identical_uploads_share_a_job(service, samplePath):
+    with open(samplePath, 'rb') as f:
+        body = f.read()
+    job, created = service.submit(body, 'turn1')
+    again, createdAgain = service.submit(body, 'turn1')
+    assert created and not createdAgain and again is job
+    wait(service)
+    assert job.status == 'done', job.error
+    assert set(job.toDict()['layers']) == {'TacMap', 'StratMap', 'OpMap'}
+    assert os.path.exists(os.path.join(service.resultDir(job.id), 'TacMap.kml'))
+    assert service.submit(body, 'turn1') == (job, False)
+    counters = service.metrics()
+    assert (counters['submitted'], counters['deduplicated'], counters['completed'], counters['pending']) == (3, 2, 1, 0)
+
+def test_failed_submission_releases_its_queue_slot(service):
+    service.pool.shutdown()
+    job, created = service.submit(b'{"ObjectStates": []}', 'broken')
+    assert created and job.status == 'failed' and job.error.startswith('RuntimeError')
+    assert (service.pending, service.counters['failed']) == (0, 1)
+    assert os.listdir(os.path.join(service.dataDir, 'uploads')) == []
+    assert os.listdir(os.path.join(service.dataDir, 'results')) == []
+    assert not service.full()